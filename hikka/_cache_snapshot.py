@@ -0,0 +1,264 @@
+"""Saves entity and full info caches to disk, so they survive restarts."""
+
+# ©️ Dan Gazizullin, 2021-2023
+# This file is a part of Hikka Userbot
+# 🌐 https://github.com/hikariatama/Hikka
+# You can redistribute it and/or modify it under the terms of the GNU AGPLv3
+# 🔑 https://www.gnu.org/licenses/agpl-3.0.html
+
+import asyncio
+import contextlib
+import json
+import logging
+import sqlite3
+import time
+import typing
+from pathlib import Path
+
+from hikkatl.extensions import BinaryReader
+from hikkatl.tl.alltlobjects import LAYER
+from hikkatl.tl.types import PeerChannel
+
+from . import utils
+from .tl_cache import CustomTelegramClient
+from .types import CacheRecordEntity, CacheRecordFullChannel, CacheRecordFullUser
+
+logger = logging.getLogger(__name__)
+
+SAVE_INTERVAL = 10 * 60
+MAX_AGE = 24 * 60 * 60  # Older records are not restored at all
+STALE_GRACE = 60  # Stale records are served for this long while being revalidated
+REVALIDATE_LIMIT = 100  # Stale full info records to refetch after restore
+REVALIDATE_DELAY = 1
+YIELD_EVERY = 256
+
+# Snapshot name -> (client cache attribute, record value attribute, record class)
+CACHES = {
+    "entity": ("hikka_entity_cache", "entity", CacheRecordEntity),
+    "fullchannel": (
+        "hikka_fullchannel_cache",
+        "full_channel",
+        CacheRecordFullChannel,
+    ),
+    "fulluser": ("hikka_fulluser_cache", "full_user", CacheRecordFullUser),
+}
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)",
+    (
+        "CREATE TABLE IF NOT EXISTS records (cache TEXT, key TEXT, value BLOB,"
+        " ts REAL, exp REAL, expires REAL, aliases TEXT, PRIMARY KEY (cache, key))"
+    ),
+)
+
+
+class CacheSnapshot:
+    """
+    Keeps SQLite snapshot of client caches. Snapshot is restored in background
+    on startup, saved periodically and on shutdown. Records, which went stale
+    while Hikka was down, are served for a short while and refetched in background
+    """
+
+    def __init__(self, client: CustomTelegramClient, path: Path):
+        """
+        :param client: Client, whose caches are saved
+        :param path: Path to snapshot file
+        """
+        self._client = client
+        self._path = path
+        self._task: typing.Optional[asyncio.Future] = None
+        self._revalidate_task: typing.Optional[asyncio.Future] = None
+        self._stopped = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self._path)
+        for statement in SCHEMA:
+            conn.execute(statement)
+
+        return conn
+
+    def _read(self) -> typing.List[tuple]:
+        if not self._path.exists():
+            return []
+
+        with contextlib.closing(self._connect()) as conn:
+            layer = conn.execute(
+                "SELECT value FROM meta WHERE key = 'layer'"
+            ).fetchone()
+            if not layer or layer[0] != str(LAYER):
+                logger.debug("Cache snapshot %s is of other layer", self._path)
+                return []
+
+            return conn.execute(
+                "SELECT cache, key, value, ts, exp, expires, aliases FROM records"
+                " WHERE ts > ? ORDER BY rowid",
+                (time.time() - MAX_AGE,),
+            ).fetchall()
+
+    def _write(self, rows: typing.List[tuple]):
+        with contextlib.closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM records")
+            conn.executemany(
+                "INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('layer', ?)",
+                (str(LAYER),),
+            )
+
+    def start(self):
+        """Restore snapshot in background and start saving it periodically"""
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        """Stop background tasks and save snapshot for the last time"""
+        if self._stopped:
+            return
+
+        self._stopped = True
+        for task in (self._task, self._revalidate_task):
+            if task:
+                task.cancel()
+
+        try:
+            await self.save()
+        except Exception:
+            logger.exception("Can't save cache snapshot")
+
+    async def _run(self):
+        try:
+            stale = await self.load()
+        except Exception:
+            logger.exception("Can't restore cache snapshot")
+        else:
+            self._revalidate_task = asyncio.ensure_future(self._revalidate(stale))
+
+        while True:
+            await asyncio.sleep(SAVE_INTERVAL)
+            try:
+                await self.save()
+            except Exception:
+                logger.exception("Can't save cache snapshot")
+
+    async def save(self) -> int:
+        """
+        Save caches to snapshot file
+        :return: Amount of saved records
+        """
+        rows = []
+        for name, (cache_attr, value_attr, _) in CACHES.items():
+            records = getattr(self._client, cache_attr).records()
+            for i, (key, record, expires, aliases) in enumerate(records):
+                if not i % YIELD_EVERY:
+                    await asyncio.sleep(0)
+
+                if not isinstance(key, (int, str)):
+                    continue
+
+                try:
+                    value = bytes(getattr(record, value_attr))
+                except Exception:
+                    logger.debug("Can't serialize %s", record, exc_info=True)
+                    continue
+
+                rows.append(
+                    (
+                        name,
+                        json.dumps(key),
+                        value,
+                        record.ts,
+                        record._exp,
+                        expires,
+                        json.dumps(
+                            [
+                                alias
+                                for alias in aliases
+                                if isinstance(alias, (int, str))
+                            ]
+                        ),
+                    )
+                )
+
+        await utils.run_sync(self._write, rows)
+        logger.debug("Saved %s cache records to %s", len(rows), self._path)
+        return len(rows)
+
+    async def load(self) -> typing.Dict[str, typing.List[typing.Hashable]]:
+        """
+        Restore caches from snapshot file. Records, which are already cached, are
+        kept as is
+        :return: Keys of stale records by cache name
+        """
+        rows = await utils.run_sync(self._read)
+        stale = {name: [] for name in CACHES}
+        restored = 0
+        now = time.time()
+        for i, (name, key, value, ts, exp, expires, aliases) in enumerate(rows):
+            if not i % YIELD_EVERY:
+                await asyncio.sleep(0)
+
+            try:
+                cache_attr, _, record_class = CACHES[name]
+                key = json.loads(key)
+                value = BinaryReader(value).tgread_object()
+            except Exception:
+                logger.debug("Can't restore %s record %s", name, key, exc_info=True)
+                continue
+
+            cache = getattr(self._client, cache_attr)
+            aliases = json.loads(aliases)
+            if any(alias in cache for alias in [key, *aliases]):
+                continue
+
+            if exp > now:
+                record = record_class(key, value, exp - now)
+                record.ts = ts
+            else:
+                record = record_class(key, value, STALE_GRACE)
+                stale[name].append(key)
+
+            cache.set(key, record, max(expires - now, STALE_GRACE), aliases)
+            restored += 1
+
+        logger.debug(
+            "Restored %s cache records from %s, %s of them are stale",
+            restored,
+            self._path,
+            sum(map(len, stale.values())),
+        )
+        return stale
+
+    async def _revalidate(self, stale: typing.Dict[str, typing.List[typing.Hashable]]):
+        entities = [
+            record.entity
+            for key in stale["entity"]
+            if (record := self._client.hikka_entity_cache.get(key))
+        ]
+        if entities:
+            try:
+                await self._client.get_entities(entities, force=True, readonly=True)
+            except Exception:
+                logger.debug("Can't revalidate restored entities", exc_info=True)
+
+        for name, method in (
+            ("fulluser", self._client.get_fulluser),
+            ("fullchannel", self._client.get_fullchannel),
+        ):
+            # Most recently used records are the last ones
+            for key in stale[name][-REVALIDATE_LIMIT:]:
+                try:
+                    await method(
+                        (
+                            PeerChannel(key)
+                            if name == "fullchannel"
+                            and isinstance(key, int)
+                            and key > 0
+                            else key
+                        ),
+                        force=True,
+                    )
+                except Exception:
+                    logger.debug("Can't revalidate %s of %s", name, key, exc_info=True)
+
+                await asyncio.sleep(REVALIDATE_DELAY)
@@ -0,0 +1,74 @@
+"""Tracks module and message, on behalf of which the current code runs."""
+
+# ©️ Dan Gazizullin, 2021-2023
+# This file is a part of Hikka Userbot
+# 🌐 https://github.com/hikariatama/Hikka
+# You can redistribute it and/or modify it under the terms of the GNU AGPLv3
+# 🔑 https://www.gnu.org/licenses/agpl-3.0.html
+
+import contextlib
+import contextvars
+import typing
+from dataclasses import dataclass
+
+from hikkatl.tl.types import Message
+
+from .types import Module
+
+
+@dataclass(frozen=True)
+class ExecutionContext:
+    """Caller of the currently running code"""
+
+    client_id: typing.Optional[int]
+    module: typing.Optional[Module] = None
+    message: typing.Optional[Message] = None
+
+    @property
+    def is_external(self) -> bool:
+        """Whether the code runs on behalf of non-core module"""
+        return isinstance(self.module, Module) and not getattr(
+            self.module, "__origin__", ""
+        ).startswith("<core")
+
+
+# Tasks copy the context on creation, so the code, spawned by module, is
+# attributed to it as well
+_current: contextvars.ContextVar[typing.Optional[ExecutionContext]] = (
+    contextvars.ContextVar("hikka_execution_context", default=None)
+)
+
+
+def get_context() -> typing.Optional[ExecutionContext]:
+    """
+    Get context of currently running code
+    :return: Context or None if code doesn't run on behalf of any module
+    """
+    return _current.get()
+
+
+@contextlib.contextmanager
+def execution_context(
+    client_id: typing.Optional[int],
+    module: typing.Any = None,
+    message: typing.Any = None,
+):
+    """
+    Run the code inside `with` block on behalf of module
+    :param client_id: Telegram id of client, which runs the code
+    :param module: Module instance or its bound method
+    :param message: Message, which triggered the code. Anything, but
+        :obj:`Message` is ignored
+    """
+    module = getattr(module, "__self__", module)
+    token = _current.set(
+        ExecutionContext(
+            client_id,
+            module if isinstance(module, Module) else None,
+            message if isinstance(message, Message) else None,
+        )
+    )
+    try:
+        yield
+    finally:
+        _current.reset(token)
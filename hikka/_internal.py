@@ -37,6 +37,19 @@ def die():
         os.killpg(os.getpgid(os.getpid()), signal.SIGTERM)
 
 
+def _flush_databases():
+    """Write pending database changes, because restart skips `atexit` hooks"""
+    if not (main := sys.modules.get(f"{__package__}.main")):
+        return
+
+    for client in main.hikka.clients:
+        if db := getattr(client, "hikka_db", None):
+            try:
+                db.flush_sync()
+            except Exception:
+                logging.exception("Can't save database before restart")
+
+
 def restart():
     if "HIKKA_DO_NOT_RESTART" in os.environ:
         print(
@@ -46,6 +59,8 @@ def restart():
         )
         sys.exit(0)
 
+    _flush_databases()
+
     logging.getLogger().setLevel(logging.CRITICAL)
 
     print("🔄 Restarting...")
@@ -8,8 +8,12 @@ import asyncio
 import collections
 import json
 import logging
+import marshal
 import os
+import signal
+import threading
 import time
+from pathlib import Path
 
 try:
     import redis
@@ -47,6 +51,149 @@ __all__ = [
 
 logger = logging.getLogger(__name__)
 
+# Journal is compacted into config, once it becomes larger than both this
+# and config itself
+JOURNAL_COMPACT_SIZE = 1024 * 1024
+# Changes, made within this window, are written at once. Can be overriden
+# with `db_save_delay` config key
+SAVE_DELAY = 3
+
+
+def _freeze(data: dict) -> typing.Union[bytes, str]:
+    """
+    Take immutable snapshot of data, so it can be serialized in other thread,
+    while the original one is being changed
+    :param data: Data to take snapshot of
+    :return: Marshalled data or, if it contains types, unsupported by marshal,
+        JSON string
+    """
+    # Items are stored instead of dict itself, so JSON keeps types of keys
+    try:
+        # Marshalling is an order of magnitude faster than serialization itself
+        return marshal.dumps(list(data.items()))
+    except ValueError:
+        return json.dumps(list(data.items()))
+
+
+def _thaw(frozen: typing.Union[bytes, str]) -> dict:
+    """
+    Restore data from snapshot, taken with :func:`_freeze`
+    :param frozen: Snapshot
+    :return: Copy of data
+    """
+    return dict(
+        json.loads(frozen) if isinstance(frozen, str) else marshal.loads(frozen)
+    )
+
+
+def _fragment(owner: str, value: dict, indent: bool) -> str:
+    """
+    Serialize single owner, so it can be spliced into database with :func:`_splice`
+    :param owner: Owner
+    :param value: Owner's keys
+    :param indent: Whether to pretty-print owner
+    :return: JSON fragment
+    """
+    if indent:
+        # Strip `{\n    ` and `\n}` of the wrapping dict
+        return json.dumps({owner: value}, indent=4)[6:-2]
+
+    return json.dumps({owner: value})[1:-1]
+
+
+def _splice(fragments: typing.Iterable[str], indent: bool) -> str:
+    """
+    Join owner fragments into database JSON. Result is the same, as if the whole
+    database was serialized at once
+    :param fragments: Fragments, made with :func:`_fragment`
+    :param indent: Whether fragments are pretty-printed
+    :return: JSON string
+    """
+    if indent:
+        data = ",\n    ".join(fragments)
+        return "{\n    " + data + "\n}" if data else "{}"
+
+    return "{" + ", ".join(fragments) + "}"
+
+
+def _field(owner: str) -> str:
+    """
+    Get Redis hash field of owner. Non-string owners are converted the same way,
+    as JSON converts keys
+    :param owner: Owner
+    :return: Field name
+    """
+    return owner if isinstance(owner, str) else json.dumps(owner)
+
+
+# Databases, which are flushed on SIGTERM, and the handler, which was there before
+_databases: typing.List["Database"] = []
+_previous_sigterm: typing.Any = None
+
+
+def _flush_on_sigterm():
+    """
+    Write pending changes of all databases, then let SIGTERM do what it
+    would have done otherwise
+    """
+    for db in _databases:
+        db.flush_sync()
+
+    if callable(_previous_sigterm):
+        _previous_sigterm(signal.SIGTERM, None)
+    elif _previous_sigterm != signal.SIG_IGN:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        os.kill(os.getpid(), signal.SIGTERM)
+
+
+def _register_flush(db: "Database"):
+    """
+    Flush database on exit and on SIGTERM, e.g. `docker stop`
+    :param db: Database to flush
+    """
+    global _previous_sigterm
+
+    utils.atexit(db.flush_sync)
+    if not _databases:
+        _previous_sigterm = signal.getsignal(signal.SIGTERM)
+        try:
+            utils.atexit(_flush_on_sigterm, use_signal=signal.SIGTERM)
+        except ValueError:
+            logger.debug("Can't handle SIGTERM outside of main thread")
+
+    _databases.append(db)
+
+
+class _Snapshot(typing.NamedTuple):
+    seq: int
+    owners: typing.List[str]
+    full: bool
+    frozen: typing.Union[bytes, str]  # Only changed owners, unless it's full
+
+
+def _write_atomic(path: Path, data: str):
+    """
+    Write file, so that after crash it contains either old or new data, but
+    never a truncated one
+    :param path: Path to file
+    :param data: Data to write
+    """
+    tmp = path.with_name(f"{path.name}.tmp")
+    with tmp.open("w") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp, path)
+
+    if hasattr(os, "O_DIRECTORY"):
+        # Persist rename itself
+        fd = os.open(path.parent, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
 
 class NoAssetsChannel(Exception):
     """Raised when trying to read/store asset with no asset channel present"""
@@ -62,37 +209,391 @@ class Database(dict):
         self._me: User = None
         self._redis: redis.Redis = None
         self._saving_task: asyncio.Future = None
+        self._generations: typing.Dict[str, int] = {}
+        self._base_generation: int = 0
+        self._db_file: Path = None
+        self._journal_file: Path = None
+        self._old_journal_file: Path = None
+        self._journal: typing.Optional[typing.TextIO] = None
+        self._journal_size: int = 0
+        self._snapshot_size: int = 0
+        self._save_delay: float = SAVE_DELAY
+        self._dirty: bool = False
+        self._flush_lock = asyncio.Lock()
+        self._write_lock = threading.Lock()
+        self._snapshot_seq: int = 0
+        self._written_seq: int = 0
+        self._dirty_owners: typing.Set[str] = set()
+        self._all_dirty: bool = True
+        # Owners, changed in journal mode without journal record
+        self._unjournaled: typing.Set[str] = set()
+        # Serialized owners, which are reused until owner is changed. Are
+        # accessed under write lock only
+        self._fragments: typing.Dict[str, str] = {}
+        self._redis_owners: typing.Set[str] = set()
+        self._redis_follower: typing.Optional[typing.Any] = None
+        self._loop: typing.Optional[asyncio.AbstractEventLoop] = None
+        self._instance_id: str = utils.rand(8)
+        self._stats: typing.Dict[str, int] = {
+            "saves": 0,
+            "writes": 0,
+            "bytes": 0,
+            "errors": 0,
+            "journal_records": 0,
+            "journal_bytes": 0,
+        }
 
     def __repr__(self):
         return object.__repr__(self)
 
-    def _redis_save_sync(self):
+    def __setitem__(self, owner: str, value: dict):
+        super().__setitem__(owner, value)
+        self._touch(owner)
+
+    def __delitem__(self, owner: str):
+        super().__delitem__(owner)
+        self._touch(owner)
+
+    def clear(self):
+        super().clear()
+        self._touch()
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._touch()
+
+    def __ior__(self, other: dict):
+        self.update(other)
+        return self
+
+    def setdefault(self, owner: str, default: typing.Optional[dict] = None) -> dict:
+        if owner not in self:
+            self[owner] = default
+
+        return super().__getitem__(owner)
+
+    def pop(self, owner: str, *args) -> dict:
+        if owner in self:
+            self._touch(owner)
+
+        return super().pop(owner, *args)
+
+    def popitem(self) -> typing.Tuple[str, dict]:
+        owner, value = super().popitem()
+        self._touch(owner)
+        return owner, value
+
+    def _touch(self, owner: typing.Optional[str] = None):
+        """
+        Bumps write generation of owner and marks it as changed
+        :param owner: Owner, which was changed. If not passed, all owners are bumped
+        """
+        if owner is None:
+            self._base_generation += 1
+            self._all_dirty = True
+        else:
+            self._generations[owner] = self._generations.get(owner, 0) + 1
+            self._dirty_owners.add(owner)
+            if self._journal:
+                self._unjournaled.add(owner)
+
+    def mark_dirty(self, owner: str):
+        """
+        Mark owner as changed, so the next :meth:`save` writes it. Must be called
+        after owner's values are changed in-place
+        :param owner: Changed owner
+        """
+        self._touch(owner)
+
+    def generation(self, owner: str) -> int:
+        """
+        Get write generation of owner. It changes every time any key of owner
+        is set, so the values, derived from owner's keys can be cached until then
+        :param owner: Owner to get generation of
+        :return: Generation counter
+        """
+        return self._base_generation + self._generations.get(owner, 0)
+
+    @property
+    def stats(self) -> typing.Dict[str, int]:
+        """
+        Get save statistics
+        :return: Amount of requested saves, actual writes, written bytes, failed
+            writes and the same for journal records
+        """
+        return self._stats.copy()
+
+    @property
+    def _redis_key(self) -> str:
+        """Hash, where each owner is stored as a separate field"""
+        return f"{self._client.tg_id}:db"
+
+    @property
+    def _redis_channel(self) -> str:
+        """Channel, where changed owners are announced"""
+        return f"{self._client.tg_id}:db:changes"
+
+    def _redis_save_sync(self, snapshot: _Snapshot, changed: dict) -> int:
+        """
+        Write changed owners to Redis hash and announce them
+        :param snapshot: Snapshot to write
+        :param changed: Changed owners from the snapshot
+        :return: Amount of written bytes
+        """
+        values = {_field(owner): json.dumps(value) for owner, value in changed.items()}
+        owners = set(map(_field, snapshot.owners))
+        removed = [] if snapshot.full else list(self._redis_owners - owners)
+        # Pipeline is a transaction, so readers never see half-written snapshot
         with self._redis.pipeline() as pipe:
-            pipe.set(
-                str(self._client.tg_id),
-                json.dumps(self, ensure_ascii=True),
+            if snapshot.full:
+                # Old single-key layout is dropped as well
+                pipe.delete(self._redis_key, str(self._client.tg_id))
+
+            if values:
+                pipe.hset(self._redis_key, mapping=values)
+
+            if removed:
+                pipe.hdel(self._redis_key, *removed)
+
+            pipe.publish(
+                self._redis_channel,
+                json.dumps(
+                    {
+                        "instance": self._instance_id,
+                        "full": snapshot.full,
+                        "owners": [*values, *removed],
+                    }
+                ),
             )
             pipe.execute()
 
-    async def remote_force_save(self) -> bool:
-        """Force save database to remote endpoint without waiting"""
-        if not self._redis:
+        self._redis_owners = owners
+        logger.debug("Published %s db owners to Redis", len(values) + len(removed))
+        return sum(map(len, values.values()))
+
+    def _redis_read(
+        self,
+        owners: typing.Optional[typing.List[str]] = None,
+    ) -> typing.Dict[str, typing.Optional[dict]]:
+        """
+        Read owners from Redis hash
+        :param owners: Owners to read. If not passed, all owners are read
+        :return: Owners' keys. Missing owners are None
+        """
+        if owners is None:
+            raw = {
+                field.decode(): value
+                for field, value in self._redis.hgetall(self._redis_key).items()
+            }
+        else:
+            raw = dict(zip(owners, self._redis.hmget(self._redis_key, owners)))
+
+        result = {}
+        for owner, value in raw.items():
+            try:
+                result[owner] = None if value is None else json.loads(value)
+            except ValueError:
+                logger.warning("Skipping broken db owner %s in Redis", owner)
+
+        return result
+
+    async def reload(self, owners: typing.Optional[typing.List[str]] = None):
+        """
+        Re-read owners from Redis, e.g. after they were changed by another instance.
+        Reloaded owners are not written back
+        :param owners: Owners to reload. If not passed, the whole database is reloaded
+        """
+        if not self._redis or (owners is not None and not owners):
+            return
+
+        values = await utils.run_sync(self._redis_read, owners)
+        if owners is None:
+            for owner in set(self) - set(values):
+                super().__delitem__(owner)
+
+            self._base_generation += 1
+
+        for owner, value in values.items():
+            if value is None:
+                super().pop(owner, None)
+            else:
+                super().__setitem__(owner, value)
+
+            self._generations[owner] = self._generations.get(owner, 0) + 1
+
+        logger.debug("Reloaded %s db owners from Redis", len(values))
+
+    def _on_redis_change(self, message: dict):
+        """Is called by pub/sub thread, when owners are changed"""
+        try:
+            change = json.loads(message["data"])
+        except (ValueError, TypeError):
+            return
+
+        if change.get("instance") == self._instance_id:
+            return
+
+        owners = None if change.get("full") else change.get("owners", [])
+        self._loop.call_soon_threadsafe(
+            lambda: asyncio.ensure_future(self.reload(owners))
+        )
+
+    def follow(self):
+        """
+        Follow database changes, made by another instance with the same account
+        (e.g. the active one, if this one is standby)
+        """
+        if not self._redis or self._redis_follower:
+            return
+
+        self._loop = asyncio.get_event_loop()
+        pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{self._redis_channel: self._on_redis_change})
+        self._redis_follower = pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+    def _write(self, snapshot: _Snapshot) -> int:
+        """
+        Write snapshot to storage. Is run in worker thread
+        :param snapshot: Snapshot, taken with :meth:`_take_snapshot`
+        :return: Amount of written bytes
+        """
+        with self._write_lock:
+            if snapshot.seq < self._written_seq:
+                # Newer snapshot is already written
+                return 0
+
+            self._written_seq = snapshot.seq
+            changed = _thaw(snapshot.frozen)
+            if self._redis:
+                return self._redis_save_sync(snapshot, changed)
+
+            # Config is pretty-printed, unless it's rewritten too often
+            indent = not self._journal
+            if snapshot.full:
+                self._fragments.clear()
+
+            for owner, value in changed.items():
+                self._fragments[owner] = _fragment(owner, value, indent)
+
+            if len(self._fragments) != len(snapshot.owners):
+                # Drop removed owners
+                self._fragments = {
+                    owner: self._fragments[owner] for owner in snapshot.owners
+                }
+
+            data = _splice(
+                (self._fragments[owner] for owner in snapshot.owners),
+                indent,
+            )
+            _write_atomic(self._db_file, data)
+            if self._journal:
+                # Everything from the old journal is in config now
+                self._old_journal_file.unlink(missing_ok=True)
+
+            return len(data)
+
+    def _take_snapshot(self) -> _Snapshot:
+        """
+        Take snapshot of owners, changed since the last one
+        :return: Snapshot
+        """
+        owners = list(self)
+        full = self._all_dirty
+        frozen = _freeze(
+            dict(self)
+            if full
+            else {owner: self[owner] for owner in self._dirty_owners if owner in self}
+        )
+        self._all_dirty = False
+        self._dirty_owners = set()
+        # Snapshot has every change, which is not in the journal
+        self._unjournaled = set()
+        if self._journal:
+            # Snapshot is taken and journal is rotated at once, so every
+            # record of the new journal is newer than snapshot
+            self._rotate_journal()
+
+        self._snapshot_seq += 1
+        return _Snapshot(self._snapshot_seq, owners, full, frozen)
+
+    def _write_failed(self):
+        self._dirty = True
+        self._stats["errors"] += 1
+        # Fragments may be left half-updated, so everything is rewritten
+        self._all_dirty = True
+
+    def _written(self, size: int):
+        if not size:
+            return
+
+        self._stats["writes"] += 1
+        self._stats["bytes"] += size
+        if self._journal:
+            self._snapshot_size = size
+
+    def _schedule_save(self):
+        """Mark database as changed and write it after a while"""
+        self._dirty = True
+        if not self._saving_task:
+            self._saving_task = asyncio.ensure_future(self._delayed_save())
+
+    async def _delayed_save(self):
+        try:
+            await asyncio.sleep(self._save_delay)
+            await self.flush()
+        finally:
+            self._saving_task = None
+
+    async def flush(self) -> bool:
+        """
+        Write pending changes right away
+        :return: True if database is saved, False if write has failed
+        """
+        async with self._flush_lock:
+            while self._dirty:
+                self._dirty = False
+                try:
+                    self._written(
+                        await utils.run_sync(self._write, self._take_snapshot())
+                    )
+                except Exception:
+                    self._write_failed()
+                    logger.exception("Database save failed!")
+                    return False
+
+        return True
+
+    def flush_sync(self) -> bool:
+        """
+        Write pending changes, blocking the current thread. Is meant to be used
+        on shutdown, when event loop is not available anymore
+        :return: True if database is saved, False if write has failed
+        """
+        if not self._dirty:
+            return True
+
+        if self._flush_lock.locked():
+            # Snapshot, which is being written now, may end up older than this
+            # one and be skipped, so its owners must be written as well
+            self._all_dirty = True
+
+        self._dirty = False
+        try:
+            self._written(self._write(self._take_snapshot()))
+        except Exception:
+            self._write_failed()
+            logger.exception("Database save failed!")
             return False
 
-        await utils.run_sync(self._redis_save_sync)
-        logger.debug("Published db to Redis")
         return True
 
-    async def _redis_save(self) -> bool:
-        """Save database to redis"""
+    async def remote_force_save(self) -> bool:
+        """Force save database to remote endpoint without waiting"""
         if not self._redis:
             return False
 
-        await asyncio.sleep(5)
-        await utils.run_sync(self._redis_save_sync)
-        logger.debug("Published db to Redis")
-        self._saving_task = None
-        return True
+        self._dirty = True
+        return await self.flush()
 
     async def redis_init(self) -> bool:
         """Init redis database"""
@@ -109,7 +610,14 @@ class Database(dict):
             await self.redis_init()
 
         self._db_file = main.BASE_PATH / f"config-{self._client.tg_id}.json"
+        self._journal_file = self._db_file.with_suffix(".journal")
+        self._old_journal_file = self._db_file.with_suffix(".journal.old")
+        self._save_delay = float(main.get_config_key("db_save_delay") or SAVE_DELAY)
         self.read()
+        _register_flush(self)
+
+        if self._redis and main.get_config_key("redis_follow"):
+            self.follow()
 
         try:
             self._assets, _ = await utils.asset_channel(
@@ -133,29 +641,157 @@ class Database(dict):
         """Read database and stores it in self"""
         if self._redis:
             try:
-                self.update(
-                    **json.loads(
-                        self._redis.get(
-                            str(self._client.tg_id),
-                        ).decode(),
-                    )
-                )
+                if self._redis.exists(self._redis_key):
+                    self.update(self._redis_read())
+                    # Hash is up to date, so only changed owners will be written
+                    self._redis_owners = set(map(_field, self))
+                    self._all_dirty = False
+                elif legacy := self._redis.get(str(self._client.tg_id)):
+                    self.update(**json.loads(legacy.decode()))
+                    # Full write replaces the old single-key layout with hash
+                    self._dirty = True
+                    if self.flush_sync():
+                        logger.info("Migrated Redis database to per-owner layout")
             except Exception:
                 logger.exception("Error reading redis database")
             return
 
         try:
-            self.update(**json.loads(self._db_file.read_text()))
+            data = self._db_file.read_text()
+            self._snapshot_size = len(data)
+            self.update(**json.loads(data))
         except json.decoder.JSONDecodeError:
             logger.warning("Database read failed! Creating new one...")
         except FileNotFoundError:
             logger.debug("Database file not found, creating new one...")
 
-    def process_db_autofix(self, db: dict) -> bool:
-        if not utils.is_serializable(db):
+        replayed = self._replay_journal()
+
+        if main.get_config_key("db_journal"):
+            self._journal = self._journal_file.open("a")
+            self._journal_size = self._journal_file.stat().st_size
+            if self._journal_size:
+                with self._journal_file.open("rb") as f:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read() != b"\n":
+                        # Don't glue new records to the cut off one
+                        self._journal.write("\n")
+
+            return
+
+        self._dirty = bool(replayed)
+        if replayed and self.flush_sync():
+            # Journal mode was turned off, so its leftovers are merged into
+            # config for the last time
+            self._journal_file.unlink(missing_ok=True)
+            self._old_journal_file.unlink(missing_ok=True)
+
+    def _replay_journal(self) -> int:
+        """
+        Apply journal records on top of database, read from config
+        :return: Amount of applied records
+        """
+        applied = 0
+        # Old journal is left only if compaction didn't finish, so it goes first
+        for path in (self._old_journal_file, self._journal_file):
+            try:
+                lines = path.read_text().splitlines()
+            except FileNotFoundError:
+                continue
+
+            for i, line in enumerate(lines):
+                try:
+                    record = json.loads(line)
+                    if isinstance(record, list):
+                        # The whole owner is replaced or removed
+                        owner, values = record
+                        if values is None:
+                            super().pop(owner, None)
+                        else:
+                            super().__setitem__(owner, values)
+                    else:
+                        for owner, values in record.items():
+                            super().setdefault(owner, {}).update(values)
+                except (ValueError, AttributeError, TypeError):
+                    # Last record is cut off, if Hikka was killed while writing it
+                    logger.warning("Skipping broken record %s of %s", i, path)
+                    continue
+
+                applied += 1
+
+        if applied:
+            self._touch()
+            logger.debug("Replayed %s journal records", applied)
+
+        return applied
+
+    def _journal_append(self, owner: str, key: str, value: JSONSerializable) -> bool:
+        """
+        Append record of single key change to journal
+        :param owner: Owner of key
+        :param key: Changed key
+        :param value: New value
+        :return: True if record was written, False otherwise
+        """
+        return self._journal_write({owner: {key: value}})
+
+    def _journal_write(self, record: typing.Union[dict, list]) -> bool:
+        """
+        Append record to journal
+        :param record: Either `{owner: {key: value}}` or `[owner, values]`, where
+            values replace the whole owner or remove it, if None
+        :return: True if record was written, False otherwise
+        """
+        record = json.dumps(record, separators=(",", ":")) + "\n"
+        try:
+            self._journal.write(record)
+            self._journal.flush()
+        except Exception:
+            logger.exception("Database journal write failed!")
+            return False
+
+        self._journal_size += len(record)
+        self._stats["journal_records"] += 1
+        self._stats["journal_bytes"] += len(record)
+        if self._journal_size > max(JOURNAL_COMPACT_SIZE, self._snapshot_size):
+            # Compact journal into config
+            self._schedule_save()
+
+        return True
+
+    def _rotate_journal(self):
+        self._journal.close()
+        try:
+            if self._old_journal_file.exists():
+                # Previous compaction has failed, so its journal is still needed
+                with self._old_journal_file.open("a") as f:
+                    f.write(self._journal_file.read_text())
+
+                self._journal_file.unlink()
+            else:
+                os.replace(self._journal_file, self._old_journal_file)
+        finally:
+            self._journal = self._journal_file.open("a")
+            self._journal_size = 0
+
+    def process_db_autofix(
+        self,
+        db: dict,
+        owners: typing.Optional[typing.Iterable[str]] = None,
+    ) -> bool:
+        """
+        Check database and drop the values, which break it
+        :param db: Database to check
+        :param owners: Owners to check. If not passed, all owners are checked
+        :return: False if database is not serializable, True otherwise
+        """
+        if owners is not None:
+            owners = {owner: db[owner] for owner in owners if owner in db}
+
+        if not utils.is_serializable(db if owners is None else owners):
             return False
 
-        for key, value in db.copy().items():
+        for key, value in (db.copy() if owners is None else owners).items():
             if not isinstance(key, (str, int)):
                 logger.warning(
                     "DbAutoFix: Dropped key %s, because it is not string or int",
@@ -189,9 +825,22 @@ class Database(dict):
 
         return True
 
-    def save(self) -> bool:
-        """Save database"""
-        if not self.process_db_autofix(self):
+    def save(self, full: bool = False) -> bool:
+        """
+        Save changed owners. Owners, changed in-place, must be marked with
+        :meth:`mark_dirty` first
+        :param full: Check and write every owner, whether it's marked or not
+        :return: True if save is scheduled or there is nothing to save
+        """
+        if full:
+            self._all_dirty = True
+
+        # Keys, which are set in journal mode, are already saved
+        owners = self._unjournaled if self._journal else self._dirty_owners
+        if not self._all_dirty and not owners:
+            return True
+
+        if not self.process_db_autofix(self, None if self._all_dirty else owners):
             try:
                 rev = self._revisions.pop()
                 while not self.process_db_autofix(rev):
@@ -217,17 +866,15 @@ class Database(dict):
         while len(self._revisions) > 15:
             self._revisions.pop()
 
-        if self._redis:
-            if not self._saving_task:
-                self._saving_task = asyncio.ensure_future(self._redis_save())
-            return True
+        self._stats["saves"] += 1
+        if self._journal and not self._all_dirty:
+            for owner in self._unjournaled:
+                self._journal_write([owner, super().get(owner)])
 
-        try:
-            self._db_file.write_text(json.dumps(self, indent=4))
-        except Exception:
-            logger.exception("Database save failed!")
-            return False
+            self._unjournaled = set()
+            return True
 
+        self._schedule_save()
         return True
 
     async def store_asset(self, message: Message) -> int:
@@ -297,7 +944,20 @@ class Database(dict):
             )
 
         super().setdefault(owner, {})[key] = value
-        return self.save()
+        if self._journal:
+            unjournaled = owner in self._unjournaled
+            self._touch(owner)
+            if self._journal_append(owner, key, value) and not unjournaled:
+                self._unjournaled.discard(owner)
+
+            return True
+
+        self._touch(owner)
+
+        # Value is already checked, so only owner is written without autofix
+        self._stats["saves"] += 1
+        self._schedule_save()
+        return True
 
     def pointer(
         self,
@@ -26,10 +26,13 @@ import asyncio
 import collections
 import contextlib
 import copy
+import functools
+import heapq
 import inspect
 import logging
 import re
 import sys
+import time
 import traceback
 import typing
 
@@ -38,66 +41,378 @@ from hikkatl.errors import FloodWaitError, RPCError
 from hikkatl.tl.types import Message
 
 from . import main, security, utils
+from ._context import execution_context
 from .database import Database
+from .latency import (
+    STAGE_HANDLER,
+    STAGE_PARSE,
+    STAGE_QUEUE,
+    STAGE_RATELIMIT,
+    STAGE_SECURITY,
+    STAGE_TAGS,
+    STAGE_TOTAL,
+    STAGE_WATCHER,
+    LatencyTracker,
+)
 from .loader import Modules
-from .tl_cache import CustomTelegramClient
+from .routing import get_tag_plan
+from .tl_cache import CustomTelegramClient, hashable
+from .types import ParsedCommand
 
 logger = logging.getLogger(__name__)
 
 # Keys for layout switch
 ru_keys = 'ёйцукенгшщзхъфывапролджэячсмитьбю.Ё"№;%:?ЙЦУКЕНГШЩЗХЪФЫВАПРОЛДЖЭ/ЯЧСМИТЬБЮ,'
 en_keys = "`qwertyuiop[]asdfghjkl;'zxcvbnm,./~@#$%^&QWERTYUIOP{}ASDFGHJKL:\"|ZXCVBNM<>?"
-ALL_TAGS = [
-    "no_commands",
-    "only_commands",
-    "out",
-    "in",
-    "only_messages",
-    "editable",
-    "no_media",
-    "only_media",
-    "only_photos",
-    "only_videos",
-    "only_audios",
-    "only_docs",
-    "only_stickers",
-    "only_inline",
-    "only_channels",
-    "only_groups",
-    "only_pm",
-    "no_pm",
-    "no_channels",
-    "no_groups",
-    "no_inline",
-    "no_stickers",
-    "no_docs",
-    "no_audios",
-    "no_videos",
-    "no_photos",
-    "no_forwards",
-    "no_reply",
-    "no_mention",
-    "mention",
-    "only_reply",
-    "only_forwards",
-    "startswith",
-    "endswith",
-    "contains",
-    "regex",
-    "filter",
-    "from_id",
-    "chat_id",
-    "thumb_url",
-    "alias",
-    "aliases",
-]
-
-
-def _decrement_ratelimit(delay, data, key, severity):
-    def inner():
-        data[key] = max(0, data[key] - severity)
-
-    asyncio.get_event_loop().call_later(delay, inner)
+LAYOUT_SWITCH = str.maketrans(ru_keys + en_keys, en_keys + ru_keys)
+
+GREP_ESCAPED = re.compile(r"\|\| ?grep")
+GREP_SEARCH = re.compile(r".+\| ?grep (.+)")
+GREP_STRIP = re.compile(r"\| ?grep.+")
+UNGREP_SEARCH = re.compile(r"-v (.+)")
+UNGREP_STRIP = re.compile(r"(.+) -v .+")
+
+
+def _frozen(value: typing.Iterable) -> typing.FrozenSet:
+    return frozenset(item for item in value if hashable(item))
+
+
+class SettingsSnapshot(typing.NamedTuple):
+    """Frozen dispatcher settings, derived from `hikka.main` database keys"""
+
+    prefix: str
+    layout_prefix: str
+    blacklist_chats: typing.FrozenSet[typing.Union[int, str]]
+    whitelist_chats: typing.FrozenSet[int]
+    whitelist_modules: typing.FrozenSet[str]
+    nonickcmds: typing.FrozenSet[str]
+    nonickusers: typing.FrozenSet[int]
+    nonickchats: typing.FrozenSet[int]
+    no_nickname: bool
+    grep: bool
+    disabled_watchers: typing.Dict[str, typing.FrozenSet[typing.Union[int, str]]]
+
+    @classmethod
+    def from_db(cls, db: Database) -> "SettingsSnapshot":
+        prefix = db.get(main.__name__, "command_prefix", False) or "."
+        return cls(
+            prefix=prefix,
+            layout_prefix=str.translate(prefix, LAYOUT_SWITCH),
+            blacklist_chats=_frozen(db.get(main.__name__, "blacklist_chats", [])),
+            whitelist_chats=_frozen(db.get(main.__name__, "whitelist_chats", [])),
+            whitelist_modules=_frozen(db.get(main.__name__, "whitelist_modules", [])),
+            nonickcmds=_frozen(db.get(main.__name__, "nonickcmds", [])),
+            nonickusers=_frozen(db.get(main.__name__, "nonickusers", [])),
+            nonickchats=_frozen(db.get(main.__name__, "nonickchats", [])),
+            no_nickname=bool(db.get(main.__name__, "no_nickname", False)),
+            grep=bool(db.get(main.__name__, "grep", False)),
+            disabled_watchers={
+                modname: _frozen(rules)
+                for modname, rules in db.get(
+                    main.__name__,
+                    "disabled_watchers",
+                    {},
+                ).items()
+            },
+        )
+
+
+PRIORITY_OWNER = 0
+PRIORITY_COMMAND = 1
+PRIORITY_WATCHER = 2
+PRIORITIES = (PRIORITY_OWNER, PRIORITY_COMMAND, PRIORITY_WATCHER)
+
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_DROP_NEWEST = "drop_newest"
+OVERFLOW_BLOCK = "block"
+OVERFLOW_POLICIES = {OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST, OVERFLOW_BLOCK}
+
+
+class _Job(typing.NamedTuple):
+    priority: int
+    seq: int
+    factory: typing.Callable[[], typing.Awaitable]
+    enqueued: float
+
+
+class _ModuleQueue:
+    def __init__(self):
+        self.pending: typing.List[typing.Deque[_Job]] = [
+            collections.deque() for _ in PRIORITIES
+        ]
+        self.running: typing.Set[asyncio.Future] = set()
+        self.space = asyncio.Event()
+        self.started = 0
+        self.dropped = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @property
+    def depth(self) -> int:
+        return sum(map(len, self.pending))
+
+    def head(self) -> typing.Optional[typing.Deque[_Job]]:
+        return next((pending for pending in self.pending if pending), None)
+
+
+class TaskScheduler:
+    """
+    Runs commands and watchers with global and per-module concurrency limits.
+    Jobs, which can't be started right away, wait in bounded per-module queues,
+    and the most important one (owner's commands, then other commands, then
+    watchers) is started as soon as there is a free slot
+    """
+
+    def __init__(
+        self,
+        global_limit: int = 256,
+        module_limit: int = 32,
+        queue_size: int = 256,
+        overflow: str = OVERFLOW_DROP_OLDEST,
+    ):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Invalid overflow policy: {overflow}")
+
+        self.global_limit = max(1, global_limit)
+        self.module_limit = max(1, module_limit)
+        self.queue_size = max(1, queue_size)
+        self.overflow = overflow
+        self._queues: typing.Dict[str, _ModuleQueue] = {}
+        self._running = 0
+        self._seq = 0
+
+    @property
+    def running(self) -> int:
+        """Number of currently running jobs"""
+        return self._running
+
+    @property
+    def depth(self) -> int:
+        """Number of jobs, waiting for a free slot"""
+        return sum(queue.depth for queue in self._queues.values())
+
+    def _can_start(self, queue: _ModuleQueue) -> bool:
+        return (
+            len(queue.running) < self.module_limit and self._running < self.global_limit
+        )
+
+    def _start(self, queue: _ModuleQueue, job: _Job):
+        wait = time.monotonic() - job.enqueued
+        queue.started += 1
+        queue.wait_total += wait
+        queue.wait_max = max(queue.wait_max, wait)
+        self._running += 1
+
+        task = asyncio.ensure_future(job.factory())
+        queue.running.add(task)
+        task.add_done_callback(functools.partial(self._release, queue))
+
+    def _release(self, queue: _ModuleQueue, task: asyncio.Future):
+        queue.running.discard(task)
+        self._running -= 1
+        self._pump()
+
+    def _pump(self):
+        """Starts the most important pending jobs while there are free slots"""
+        while self._running < self.global_limit:
+            best = None
+            for queue in self._queues.values():
+                if len(queue.running) >= self.module_limit:
+                    continue
+
+                pending = queue.head()
+                if pending and (
+                    best is None
+                    or (pending[0].priority, pending[0].seq)
+                    < (best[1][0].priority, best[1][0].seq)
+                ):
+                    best = (queue, pending)
+
+            if best is None:
+                return
+
+            queue, pending = best
+            self._start(queue, pending.popleft())
+            queue.space.set()
+
+    def _drop_for(self, queue: _ModuleQueue, job: _Job) -> bool:
+        """
+        Frees space in full queue for the job. Less important jobs are always
+        evicted first, and overflow policy only decides between jobs of the
+        same priority
+        :return: False if there is no job to evict for the new one
+        """
+        victims = next(
+            (pending for pending in reversed(queue.pending) if pending),
+            None,
+        )
+        if victims is None or victims[0].priority < job.priority:
+            return False
+
+        if self.overflow == OVERFLOW_DROP_OLDEST:
+            victims.popleft()
+        elif victims[0].priority == job.priority:
+            return False
+        else:
+            victims.pop()
+
+        queue.dropped += 1
+        return True
+
+    async def submit(
+        self,
+        module: str,
+        priority: int,
+        factory: typing.Callable[[], typing.Awaitable],
+    ) -> bool:
+        """
+        Schedules a job
+        :param module: Name of the module, which job belongs to
+        :param priority: One of `PRIORITY_*` constants
+        :param factory: Callable, which returns awaitable to run
+        :return: False if job was dropped due to queue overflow
+        """
+        self._seq += 1
+        job = _Job(priority, self._seq, factory, time.monotonic())
+        queue = self._queues.setdefault(module, _ModuleQueue())
+
+        if not queue.depth and self._can_start(queue):
+            self._start(queue, job)
+            return True
+
+        while queue.depth >= self.queue_size:
+            if self._drop_for(queue, job):
+                continue
+
+            if self.overflow == OVERFLOW_BLOCK:
+                queue.space.clear()
+                await queue.space.wait()
+                if self._queues.get(module) is not queue:
+                    # Module was unloaded while we were waiting
+                    return False
+
+                continue
+
+            queue.dropped += 1
+            logger.debug("Dropped job of module %s due to overflow", module)
+            return False
+
+        queue.pending[priority].append(job)
+        self._pump()
+        return True
+
+    def cancel(self, module: str) -> int:
+        """
+        Drops pending jobs of the module and cancels the running ones
+        :param module: Name of the module
+        :return: Number of dropped and cancelled jobs
+        """
+        if not (queue := self._queues.pop(module, None)):
+            return 0
+
+        count = queue.depth
+        for pending in queue.pending:
+            pending.clear()
+
+        current = asyncio.current_task()
+        for task in queue.running.copy():
+            if task is not current:
+                task.cancel()
+                count += 1
+
+        queue.space.set()
+        logger.debug("Cancelled %s jobs of module %s", count, module)
+        return count
+
+    def stats(self) -> dict:
+        """
+        Get queue depth and wait time of each module
+        :return: Dictionary, which can be serialized to JSON
+        """
+        return {
+            "running": self._running,
+            "queued": self.depth,
+            "global_limit": self.global_limit,
+            "module_limit": self.module_limit,
+            "queue_size": self.queue_size,
+            "overflow": self.overflow,
+            "modules": {
+                module: {
+                    "running": len(queue.running),
+                    "queued": queue.depth,
+                    "started": queue.started,
+                    "dropped": queue.dropped,
+                    "avg_wait": (
+                        queue.wait_total / queue.started if queue.started else 0.0
+                    ),
+                    "max_wait": queue.wait_max,
+                }
+                for module, queue in self._queues.items()
+            },
+        }
+
+
+class SeverityLimiter:
+    """
+    Ratelimiter, which keeps weights of recent messages per key. Each message
+    holds its weight for the given time, just like the timer per message used
+    to do, but expired weights are dropped lazily on access. Least recently
+    used keys are evicted once there are too many of them
+    """
+
+    def __init__(self, max_keys: int = 4096, max_entries: int = 64):
+        self.max_keys = max_keys
+        self.max_entries = max_entries
+        # Key -> [level, heap of (expiry, weight)]
+        self._keys: typing.OrderedDict[int, list] = collections.OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def level(self, key: int) -> float:
+        """
+        Get sum of weights, which are still held
+        :param key: Key
+        :return: Used allowance
+        """
+        if (entry := self._keys.get(key)) is None:
+            return 0.0
+
+        heap = entry[1]
+        now = time.monotonic()
+        while heap and heap[0][0] <= now:
+            entry[0] -= heapq.heappop(heap)[1]
+
+        if not heap:
+            del self._keys[key]
+            return 0.0
+
+        return entry[0]
+
+    def add(self, key: int, weight: float, hold: float) -> float:
+        """
+        Adds weight to the key
+        :param key: Key
+        :param weight: Weight to add
+        :param hold: Time in seconds, after which weight expires
+        :return: New level of key
+        """
+        self.level(key)
+        entry = self._keys.setdefault(key, [0.0, []])
+        heap = entry[1]
+        entry[0] += weight
+        if len(heap) >= self.max_entries:
+            # Weight, which expires first, is merged into the new one, so it's
+            # held longer and limiting can only get stricter
+            weight += heapq.heappop(heap)[1]
+
+        heapq.heappush(heap, (time.monotonic() + hold, weight))
+        self._keys.move_to_end(key)
+
+        while len(self._keys) > self.max_keys:
+            self._keys.popitem(last=False)
+
+        return entry[0]
 
 
 class CommandDispatcher:
@@ -112,13 +427,24 @@ class CommandDispatcher:
         self.client = client
         self._db = db
 
-        self._ratelimit_storage_user = collections.defaultdict(int)
-        self._ratelimit_storage_chat = collections.defaultdict(int)
+        self._ratelimit_storage_user = SeverityLimiter()
         self._ratelimit_max_user = db.get(__name__, "ratelimit_max_user", 30)
         self._ratelimit_max_chat = db.get(__name__, "ratelimit_max_chat", 100)
 
         self.security = security.SecurityManager(client, db)
 
+        overflow = db.get(__name__, "scheduler_overflow", OVERFLOW_DROP_OLDEST)
+        self.scheduler = TaskScheduler(
+            global_limit=db.get(__name__, "scheduler_global_limit", 256),
+            module_limit=db.get(__name__, "scheduler_module_limit", 32),
+            queue_size=db.get(__name__, "scheduler_queue_size", 256),
+            overflow=(
+                overflow if overflow in OVERFLOW_POLICIES else OVERFLOW_DROP_OLDEST
+            ),
+        )
+
+        self.latency = LatencyTracker()
+
         self.check_security = self.security.check
         self._me = self._client.hikka_me.id
         self._cached_usernames = [
@@ -134,78 +460,76 @@ class CommandDispatcher:
         )
 
         self.raw_handlers = []
+        self._raw_handlers_index: typing.Dict[type, typing.Tuple[callable, ...]] = {}
+        self._settings: typing.Optional[SettingsSnapshot] = None
+        self._settings_generation: int = -1
+
+    @property
+    def settings(self) -> SettingsSnapshot:
+        """Snapshot of dispatcher settings, rebuilt only when they are changed"""
+        generation = self._db.generation(main.__name__)
+        if self._settings is None or self._settings_generation != generation:
+            self._settings = SettingsSnapshot.from_db(self._db)
+            self._settings_generation = generation
+
+        return self._settings
 
     async def _handle_ratelimit(self, message: Message, func: callable) -> bool:
         if await self.security.check(message, security.OWNER):
             return True
 
         func = getattr(func, "__func__", func)
-        ret = True
-        chat = self._ratelimit_storage_chat[message.chat_id]
-
-        if message.sender_id:
-            user = self._ratelimit_storage_user[message.sender_id]
-            severity = (5 if getattr(func, "ratelimit", False) else 2) * (
-                (user + chat) // 30 + 1
-            )
-            user += severity
-            self._ratelimit_storage_user[message.sender_id] = user
-            if user > self._ratelimit_max_user:
-                ret = False
-            else:
-                self._ratelimit_storage_chat[message.chat_id] = chat
-
-            _decrement_ratelimit(
-                self._ratelimit_max_user * severity,
-                self._ratelimit_storage_user,
-                message.sender_id,
-                severity,
-            )
-        else:
-            severity = (5 if getattr(func, "ratelimit", False) else 2) * (
-                chat // 15 + 1
-            )
-
-        chat += severity
-
-        if chat > self._ratelimit_max_chat:
-            ret = False
-
-        _decrement_ratelimit(
-            self._ratelimit_max_chat * severity,
-            self._ratelimit_storage_chat,
-            message.chat_id,
+        base = 5 if getattr(func, "ratelimit", False) else 2
+
+        # Chat counter of the timer-based limiter was never increased, so chat
+        # level is always zero and chat limit only applies to a single severity
+        if not message.sender_id:
+            return base <= self._ratelimit_max_chat
+
+        user = self._ratelimit_storage_user.level(message.sender_id)
+        severity = base * (int(user) // 30 + 1)
+        # Each message holds its severity for `max * severity` seconds,
+        # exactly as long as the timers used to
+        user = self._ratelimit_storage_user.add(
+            message.sender_id,
             severity,
+            self._ratelimit_max_user * severity,
         )
+        return user <= self._ratelimit_max_user and severity <= self._ratelimit_max_chat
 
-        return ret
-
-    def _handle_grep(self, message: Message) -> Message:
+    def _handle_grep(
+        self,
+        message: Message,
+        parsed: typing.Optional[ParsedCommand] = None,
+    ) -> Message:
         # Allow escaping grep with double stick
         if "||grep" in message.text or "|| grep" in message.text:
-            message.raw_text = re.sub(r"\|\| ?grep", "| grep", message.raw_text)
-            message.text = re.sub(r"\|\| ?grep", "| grep", message.text)
-            message.message = re.sub(r"\|\| ?grep", "| grep", message.message)
+            message.raw_text = GREP_ESCAPED.sub("| grep", message.raw_text)
+            message.text = GREP_ESCAPED.sub("| grep", message.text)
+            message.message = GREP_ESCAPED.sub("| grep", message.message)
             return message
 
-        grep = False
-        if not re.search(r".+\| ?grep (.+)", message.raw_text):
+        if not (match := GREP_SEARCH.search(message.raw_text)):
             return message
 
-        grep = re.search(r".+\| ?grep (.+)", message.raw_text).group(1)
-        message.text = re.sub(r"\| ?grep.+", "", message.text)
-        message.raw_text = re.sub(r"\| ?grep.+", "", message.raw_text)
-        message.message = re.sub(r"\| ?grep.+", "", message.message)
+        grep = match.group(1)
+        message.text = GREP_STRIP.sub("", message.text)
+        message.raw_text = GREP_STRIP.sub("", message.raw_text)
+        message.message = GREP_STRIP.sub("", message.message)
 
         ungrep = False
 
-        if re.search(r"-v (.+)", grep):
-            ungrep = re.search(r"-v (.+)", grep).group(1)
-            grep = re.sub(r"(.+) -v .+", r"\g<1>", grep)
+        if match := UNGREP_SEARCH.search(grep):
+            ungrep = match.group(1)
+            grep = UNGREP_STRIP.sub(r"\g<1>", grep)
 
         grep = utils.escape_html(grep).strip() if grep else False
         ungrep = utils.escape_html(ungrep).strip() if ungrep else False
 
+        if parsed is not None:
+            parsed.grep = grep
+            parsed.ungrep = ungrep
+
         old_edit = message.edit
         old_reply = message.reply
         old_respond = message.respond
@@ -273,8 +597,10 @@ class CommandDispatcher:
         if not hasattr(event, "message") or not hasattr(event.message, "message"):
             return False
 
-        prefix = self._db.get(main.__name__, "command_prefix", False) or "."
-        change = str.maketrans(ru_keys + en_keys, en_keys + ru_keys)
+        mark = time.perf_counter()
+        settings = self.settings
+        prefix = settings.prefix
+        layout_prefix = settings.layout_prefix
         message = utils.censor(event.message)
 
         if not event.message.message:
@@ -286,8 +612,8 @@ class CommandDispatcher:
             and (
                 message.message.startswith(prefix * 2)
                 and any(s != prefix for s in message.message)
-                or message.message.startswith(str.translate(prefix * 2, change))
-                and any(s != str.translate(prefix, change) for s in message.message)
+                or message.message.startswith(layout_prefix * 2)
+                and any(s != layout_prefix for s in message.message)
             )
         ):
             # Allow escaping commands using .'s
@@ -302,12 +628,9 @@ class CommandDispatcher:
                 )
             return False
 
-        if (
-            event.message.message.startswith(str.translate(prefix, change))
-            and str.translate(prefix, change) != prefix
-        ):
-            message.message = str.translate(message.message, change)
-            message.text = str.translate(message.text, change)
+        if event.message.message.startswith(layout_prefix) and layout_prefix != prefix:
+            message.message = str.translate(message.message, LAYOUT_SWITCH)
+            message.text = str.translate(message.text, LAYOUT_SWITCH)
         elif not event.message.message.startswith(prefix):
             return False
 
@@ -320,12 +643,13 @@ class CommandDispatcher:
         ):
             return False
 
-        blacklist_chats = self._db.get(main.__name__, "blacklist_chats", [])
-        whitelist_chats = self._db.get(main.__name__, "whitelist_chats", [])
-        whitelist_modules = self._db.get(main.__name__, "whitelist_modules", [])
+        blacklist_chats = settings.blacklist_chats
+        whitelist_chats = settings.whitelist_chats
+        whitelist_modules = settings.whitelist_modules
+        chat_id = utils.get_chat_id(message)
 
-        if utils.get_chat_id(message) in blacklist_chats or (
-            whitelist_chats and utils.get_chat_id(message) not in whitelist_chats
+        if chat_id in blacklist_chats or (
+            whitelist_chats and chat_id not in whitelist_chats
         ):
             return False
 
@@ -336,6 +660,12 @@ class CommandDispatcher:
 
         command = message.message[1:].strip().split(maxsplit=1)[0]
         tag = command.split("@", maxsplit=1)
+        parsed = ParsedCommand(
+            prefix=prefix,
+            alias=tag[0],
+            tag=tag[1] if len(tag) == 2 else None,
+        )
+        message.hikka_parsed_command = parsed
 
         if len(tag) == 2:
             if tag[1] == "me":
@@ -356,40 +686,57 @@ class CommandDispatcher:
             pass
         elif (
             not event.is_private
-            and not self._db.get(main.__name__, "no_nickname", False)
-            and command not in self._db.get(main.__name__, "nonickcmds", [])
-            and initiator not in self._db.get(main.__name__, "nonickusers", [])
+            and not settings.no_nickname
+            and command not in settings.nonickcmds
+            and initiator not in settings.nonickusers
             and not self.security.check_tsec(initiator, command)
-            and utils.get_chat_id(event)
-            not in self._db.get(main.__name__, "nonickchats", [])
+            and chat_id not in settings.nonickchats
         ):
             return False
 
         txt, func = self._modules.dispatch(tag[0])
 
+        if not func:
+            return False
+
+        if not watcher:
+            mark = self._lap(func, txt, STAGE_PARSE, mark)
+
+        if not await self._handle_ratelimit(message, func):
+            return False
+
+        if not watcher:
+            mark = self._lap(func, txt, STAGE_RATELIMIT, mark)
+
+        allowed = await self.security.check(
+            message,
+            func,
+            usernames=self._cached_usernames,
+        )
+
+        if not allowed:
+            if not watcher:
+                self._lap(func, txt, STAGE_SECURITY, mark)
+            return False
+
         if (
-            not func
-            or not await self._handle_ratelimit(message, func)
-            or not await self.security.check(
-                message,
-                func,
-                usernames=self._cached_usernames,
+            message.is_channel
+            and message.edit_date
+            and not message.is_group
+            and (
+                editor := await self._client.get_edit_author(
+                    chat_id,
+                    message.id,
+                    message.edit_date,
+                )
             )
+            and editor != self._client.tg_id
         ):
+            logger.debug("Ignoring edit in channel")
             return False
 
-        if message.is_channel and message.edit_date and not message.is_group:
-            async for event in self._client.iter_admin_log(
-                utils.get_chat_id(message),
-                limit=10,
-                edit=True,
-            ):
-                if event.action.prev_message.id == message.id:
-                    if event.user_id != self._client.tg_id:
-                        logger.debug("Ignoring edit in channel")
-                        return False
-
-                    break
+        if not watcher:
+            mark = self._lap(func, txt, STAGE_SECURITY, mark)
 
         if (
             message.is_channel
@@ -404,48 +751,143 @@ class CommandDispatcher:
         message.message = prefix + txt + message.message[len(prefix + command) :]
 
         if (
-            f"{str(utils.get_chat_id(message))}.{func.__self__.__module__}"
-            in blacklist_chats
+            f"{chat_id}.{func.__self__.__module__}" in blacklist_chats
             or whitelist_modules
-            and f"{utils.get_chat_id(message)}.{func.__self__.__module__}"
-            not in whitelist_modules
+            and f"{chat_id}.{func.__self__.__module__}" not in whitelist_modules
         ):
             return False
 
         if await self._handle_tags(event, func):
             return False
 
-        if self._db.get(main.__name__, "grep", False) and not watcher:
-            message = self._handle_grep(message)
+        if settings.grep and not watcher:
+            message = self._handle_grep(message, parsed)
+
+        parsed.command = txt
+        parsed.source = message.message
+        args = message.message.split(maxsplit=1)
+        parsed.args_raw = args[1] if len(args) > 1 else ""
+
+        if not watcher:
+            self._lap(func, txt, STAGE_TAGS, mark)
 
         return message, prefix, txt, func
 
+    def _lap(self, func: callable, command: str, stage: str, since: float) -> float:
+        """
+        Record duration of command pipeline stage
+        :param func: Command function
+        :param command: Command name
+        :param stage: Stage name
+        :param since: Moment, when stage has started
+        :return: Moment, when stage has finished
+        """
+        now = time.perf_counter()
+        self.latency.record(
+            func.__self__.__class__.__name__,
+            command,
+            stage,
+            now - since,
+        )
+        return now
+
+    def add_raw_handler(self, handler: callable):
+        """Register raw handler and reset routing index"""
+        self.raw_handlers.append(handler)
+        self._raw_handlers_index = {}
+
+    def remove_raw_handler(self, handler: callable):
+        """Unregister raw handler and reset routing index"""
+        self.raw_handlers.remove(handler)
+        self._raw_handlers_index = {}
+
+    def _get_raw_handlers(self, update_type: type) -> typing.Tuple[callable, ...]:
+        """
+        Get raw handlers of update type. Handlers, registered for base classes
+        of the type are included. Result is cached until handlers are changed
+        :param update_type: Type of raw update
+        :return: Matching handlers
+        """
+        try:
+            return self._raw_handlers_index[update_type]
+        except KeyError:
+            handlers = self._raw_handlers_index[update_type] = tuple(
+                handler
+                for handler in self.raw_handlers
+                if issubclass(update_type, tuple(handler.updates))
+            )
+            return handlers
+
+    async def _run_raw_handler(self, handler: callable, event: events.Raw):
+        try:
+            with execution_context(self.client.tg_id, handler):
+                await handler(event)
+        except Exception as e:
+            logger.exception("Error in raw handler %s: %s", handler.id, e)
+
     async def handle_raw(self, event: events.Raw):
         """Handle raw events."""
-        for handler in self.raw_handlers:
-            if isinstance(event, tuple(handler.updates)):
-                try:
-                    await handler(event)
-                except Exception as e:
-                    logger.exception("Error in raw handler %s: %s", handler.id, e)
+        for handler in self._get_raw_handlers(type(event)):
+            await self.scheduler.submit(
+                handler.__self__.__class__.__name__,
+                PRIORITY_WATCHER,
+                functools.partial(self._run_raw_handler, handler, event),
+            )
 
     async def handle_command(
         self,
         event: typing.Union[events.NewMessage, events.MessageDeleted],
     ):
         """Handle all commands"""
+        started = time.perf_counter()
         message = await self._handle_command(event)
         if not message:
             return
 
-        message, _, _, func = message
+        message, _, txt, func = message
 
-        asyncio.ensure_future(
-            self.future_dispatcher(
+        await self.scheduler.submit(
+            func.__self__.__class__.__name__,
+            (
+                PRIORITY_OWNER
+                if message.out or message.sender_id in self.security.owner
+                else PRIORITY_COMMAND
+            ),
+            functools.partial(
+                self._dispatch_command,
                 func,
+                txt,
                 message,
-                self.command_exc,
-            )
+                started,
+                time.perf_counter(),
+            ),
+        )
+
+    async def _dispatch_command(
+        self,
+        func: callable,
+        command: str,
+        message: Message,
+        started: float,
+        enqueued: float,
+    ):
+        start = time.perf_counter()
+        module = func.__self__.__class__.__name__
+        self.latency.record(module, command, STAGE_QUEUE, start - enqueued)
+        error = not await self.future_dispatcher(func, message, self.command_exc)
+        end = time.perf_counter()
+        self.latency.record(module, command, STAGE_HANDLER, end - start, error)
+        self.latency.record(module, command, STAGE_TOTAL, end - started, error)
+
+    async def _dispatch_watcher(self, func: callable, message: Message):
+        start = time.perf_counter()
+        error = not await self.future_dispatcher(func, message, self.watcher_exc)
+        self.latency.record(
+            func.__self__.__class__.__name__,
+            None,
+            STAGE_WATCHER,
+            time.perf_counter() - start,
+            error,
         )
 
     async def command_exc(self, _, message: Message):
@@ -511,109 +953,63 @@ class CommandDispatcher:
         self,
         event: typing.Union[events.NewMessage, events.MessageDeleted],
         func: callable,
+        **kwargs,
     ) -> bool:
-        return bool(await self._handle_tags_ext(event, func))
+        return bool(await self._handle_tags_ext(event, func, **kwargs))
+
+    async def _is_command(
+        self,
+        event: typing.Union[events.NewMessage, events.MessageDeleted],
+        command_memo: typing.Optional[dict] = None,
+    ) -> bool:
+        """
+        Checks whether event is a command, which would be processed.
+        :param event: The event to check.
+        :param command_memo: Per-event storage, so the check is done only once.
+        :return: True if event is a command.
+        """
+        if command_memo is None:
+            return bool(await self._handle_command(event, watcher=True))
+
+        if "is_command" not in command_memo:
+            command_memo["is_command"] = bool(
+                await self._handle_command(event, watcher=True)
+            )
+
+        return command_memo["is_command"]
 
     async def _handle_tags_ext(
         self,
         event: typing.Union[events.NewMessage, events.MessageDeleted],
         func: callable,
+        *,
+        command_memo: typing.Optional[dict] = None,
+        routed: bool = False,
     ) -> str:
         """
         Handle tags.
         :param event: The event to handle.
         :param func: The function to handle.
+        :param command_memo: Per-event storage for command check result.
+        :param routed: Whether the event was routed to the function by watcher router.
         :return: The reason for the tag to fail.
         """
         m = event if isinstance(event, Message) else getattr(event, "message", event)
+        plan = get_tag_plan(func)
 
-        reverse_mapping = {
-            "out": lambda: getattr(m, "out", True),
-            "in": lambda: not getattr(m, "out", True),
-            "only_messages": lambda: isinstance(m, Message),
-            "editable": (
-                lambda: not getattr(m, "out", False)
-                and not getattr(m, "fwd_from", False)
-                and not getattr(m, "sticker", False)
-                and not getattr(m, "via_bot_id", False)
-            ),
-            "no_media": lambda: (
-                not isinstance(m, Message) or not getattr(m, "media", False)
-            ),
-            "only_media": lambda: isinstance(m, Message) and getattr(m, "media", False),
-            "only_photos": lambda: utils.mime_type(m).startswith("image/"),
-            "only_videos": lambda: utils.mime_type(m).startswith("video/"),
-            "only_audios": lambda: utils.mime_type(m).startswith("audio/"),
-            "only_stickers": lambda: getattr(m, "sticker", False),
-            "only_docs": lambda: getattr(m, "document", False),
-            "only_inline": lambda: getattr(m, "via_bot_id", False),
-            "only_channels": lambda: (
-                getattr(m, "is_channel", False) and not getattr(m, "is_group", False)
-            ),
-            "no_channels": lambda: not getattr(m, "is_channel", False),
-            "no_groups": (
-                lambda: not getattr(m, "is_group", False)
-                or getattr(m, "private", False)
-                or getattr(m, "is_channel", False)
-            ),
-            "only_groups": (
-                lambda: getattr(m, "is_group", False)
-                or not getattr(m, "private", False)
-                and not getattr(m, "is_channel", False)
-            ),
-            "no_pm": lambda: not getattr(m, "private", False),
-            "only_pm": lambda: getattr(m, "private", False),
-            "no_inline": lambda: not getattr(m, "via_bot_id", False),
-            "no_stickers": lambda: not getattr(m, "sticker", False),
-            "no_docs": lambda: not getattr(m, "document", False),
-            "no_audios": lambda: not utils.mime_type(m).startswith("audio/"),
-            "no_videos": lambda: not utils.mime_type(m).startswith("video/"),
-            "no_photos": lambda: not utils.mime_type(m).startswith("image/"),
-            "no_forwards": lambda: not getattr(m, "fwd_from", False),
-            "no_reply": lambda: not getattr(m, "reply_to_msg_id", False),
-            "only_forwards": lambda: getattr(m, "fwd_from", False),
-            "only_reply": lambda: getattr(m, "reply_to_msg_id", False),
-            "mention": lambda: getattr(m, "mentioned", False),
-            "no_mention": lambda: not getattr(m, "mentioned", False),
-            "startswith": lambda: (
-                isinstance(m, Message) and m.raw_text.startswith(func.startswith)
-            ),
-            "endswith": lambda: (
-                isinstance(m, Message) and m.raw_text.endswith(func.endswith)
-            ),
-            "contains": lambda: isinstance(m, Message) and func.contains in m.raw_text,
-            "filter": lambda: callable(func.filter) and func.filter(m),
-            "from_id": lambda: getattr(m, "sender_id", None) == func.from_id,
-            "chat_id": lambda: utils.get_chat_id(m) == (
-                func.chat_id
-                if not str(func.chat_id).startswith("-100")
-                else int(str(func.chat_id)[4:])
-            ),
-            "regex": lambda: (
-                isinstance(m, Message) and re.search(func.regex, m.raw_text)
-            ),
-        }
+        if reason := plan.first_failed(m, routed):
+            return reason
 
-        return (
-            "no_commands"
-            if getattr(func, "no_commands", False)
-            and await self._handle_command(event, watcher=True)
-            else (
-                "only_commands"
-                if getattr(func, "only_commands", False)
-                and not await self._handle_command(event, watcher=True)
-                else next(
-                    (
-                        tag
-                        for tag in ALL_TAGS
-                        if getattr(func, tag, False)
-                        and tag in reverse_mapping
-                        and not reverse_mapping[tag]()
-                    ),
-                    None,
-                )
-            )
-        )
+        if plan.no_commands or plan.only_commands:
+            is_command = await self._is_command(event, command_memo)
+
+            if plan.no_commands and is_command:
+                return "no_commands"
+
+            if plan.only_commands and not is_command:
+                return "only_commands"
+
+        return None
 
     async def handle_incoming(
         self,
@@ -622,9 +1018,10 @@ class CommandDispatcher:
         """Handle all incoming messages"""
         message = utils.censor(getattr(event, "message", event))
 
-        blacklist_chats = self._db.get(main.__name__, "blacklist_chats", [])
-        whitelist_chats = self._db.get(main.__name__, "whitelist_chats", [])
-        whitelist_modules = self._db.get(main.__name__, "whitelist_modules", [])
+        settings = self.settings
+        blacklist_chats = settings.blacklist_chats
+        whitelist_chats = settings.whitelist_chats
+        whitelist_modules = settings.whitelist_modules
 
         if utils.get_chat_id(message) in blacklist_chats or (
             whitelist_chats and utils.get_chat_id(message) not in whitelist_chats
@@ -632,8 +1029,10 @@ class CommandDispatcher:
             logger.debug("Message is blacklisted")
             return
 
-        for func in self._modules.watchers:
-            bl = self._db.get(main.__name__, "disabled_watchers", {})
+        bl = settings.disabled_watchers
+        command_memo = {}
+
+        for func in self._modules.watcher_router.candidates(message):
             modname = str(func.__self__.__class__.strings["name"])
 
             if (
@@ -651,17 +1050,32 @@ class CommandDispatcher:
                     or "in" in bl[modname]
                     and message.out
                 )
-                or f"{str(utils.get_chat_id(message))}.{func.__self__.__module__}"
+            ):
+                reason = "disabled_watchers"
+            elif (
+                f"{str(utils.get_chat_id(message))}.{func.__self__.__module__}"
                 in blacklist_chats
-                or whitelist_modules
+            ):
+                reason = "blacklist_chats"
+            elif (
+                whitelist_modules
                 and f"{str(utils.get_chat_id(message))}.{func.__self__.__module__}"
                 not in whitelist_modules
-                or await self._handle_tags(event, func)
             ):
+                reason = "whitelist_modules"
+            else:
+                reason = await self._handle_tags_ext(
+                    event,
+                    func,
+                    command_memo=command_memo,
+                    routed=True,
+                )
+
+            if reason:
                 logger.debug(
                     "Ignored watcher of module %s because of %s",
                     modname,
-                    await self._handle_tags_ext(event, func),
+                    reason,
                 )
                 continue
 
@@ -674,14 +1088,13 @@ class CommandDispatcher:
                 except UnicodeDecodeError:
                     pass
 
-            # Run watcher via ensure_future so in case user has a lot
-            # of watchers with long actions, they can run simultaneously
-            asyncio.ensure_future(
-                self.future_dispatcher(
-                    func,
-                    message,
-                    self.watcher_exc,
-                )
+            # Run watcher via scheduler so in case user has a lot
+            # of watchers with long actions, they can run simultaneously,
+            # but can't flood the event loop
+            await self.scheduler.submit(
+                func.__self__.__class__.__name__,
+                PRIORITY_WATCHER,
+                functools.partial(self._dispatch_watcher, func, message),
             )
 
     async def future_dispatcher(
@@ -694,7 +1107,11 @@ class CommandDispatcher:
         # Will be used to determine, which client caused logging messages
         # parsed via inspect.stack()
         _hikka_client_id_logging_tag = copy.copy(self.client.tg_id)  # noqa: F841
-        try:
-            await func(message)
-        except Exception as e:
-            await exception_handler(e, message, *args)
+        with execution_context(self.client.tg_id, func, message):
+            try:
+                await func(message)
+            except Exception as e:
+                await exception_handler(e, message, *args)
+                return False
+
+        return True
@@ -23,6 +23,7 @@ from aiogram.types import (
 from aiogram.types import Message as AiogramMessage
 
 from .. import utils
+from .._context import execution_context
 from .types import BotInlineCall, InlineCall, InlineQuery, InlineUnit
 
 logger = logging.getLogger(__name__)
@@ -43,7 +44,8 @@ class Events(InlineUnit):
                 continue
 
             try:
-                await mod.aiogram_watcher(message)
+                with execution_context(self._client.tg_id, mod):
+                    await mod.aiogram_watcher(message)
             except Exception:
                 logger.exception("Error on running aiogram watcher!")
 
@@ -64,9 +66,13 @@ class Events(InlineUnit):
             instance = InlineQuery(inline_query)
 
             try:
-                if not (
-                    result := await self._allmodules.inline_handlers[cmd](instance)
+                with execution_context(
+                    self._client.tg_id,
+                    self._allmodules.inline_handlers[cmd],
                 ):
+                    result = await self._allmodules.inline_handlers[cmd](instance)
+
+                if not result:
                     return
             except Exception:
                 logger.exception("Error on running inline watcher!")
@@ -225,13 +231,14 @@ class Events(InlineUnit):
         for func in self._allmodules.callback_handlers.values():
             if await self.check_inline_security(func=func, user=call.from_user.id):
                 try:
-                    await func(
-                        (
-                            BotInlineCall
-                            if getattr(getattr(call, "message", None), "chat", None)
-                            else InlineCall
-                        )(call, self, None)
-                    )
+                    with execution_context(self._client.tg_id, func):
+                        await func(
+                            (
+                                BotInlineCall
+                                if getattr(getattr(call, "message", None), "chat", None)
+                                else InlineCall
+                            )(call, self, None)
+                        )
                 except Exception:
                     logger.exception("Error on running callback watcher!")
                     await call.answer(
@@ -280,15 +287,22 @@ class Events(InlineUnit):
                         return
 
                     try:
-                        result = await button["callback"](
-                            (
-                                BotInlineCall
-                                if getattr(getattr(call, "message", None), "chat", None)
-                                else InlineCall
-                            )(call, self, unit_id),
-                            *button.get("args", []),
-                            **button.get("kwargs", {}),
-                        )
+                        with execution_context(
+                            self._client.tg_id,
+                            button["callback"],
+                            unit.get("message"),
+                        ):
+                            result = await button["callback"](
+                                (
+                                    BotInlineCall
+                                    if getattr(
+                                        getattr(call, "message", None), "chat", None
+                                    )
+                                    else InlineCall
+                                )(call, self, unit_id),
+                                *button.get("args", []),
+                                **button.get("kwargs", {}),
+                            )
                     except Exception:
                         logger.exception("Error on running callback watcher!")
                         await call.answer(
@@ -331,15 +345,20 @@ class Events(InlineUnit):
                 await call.answer(self.translator.getkey("inline.button403"))
                 return
 
-            await self._custom_map[call.data]["handler"](
-                (
-                    BotInlineCall
-                    if getattr(getattr(call, "message", None), "chat", None)
-                    else InlineCall
-                )(call, self, None),
-                *self._custom_map[call.data].get("args", []),
-                **self._custom_map[call.data].get("kwargs", {}),
-            )
+            with execution_context(
+                self._client.tg_id,
+                self._custom_map[call.data]["handler"],
+                self._custom_map[call.data].get("message"),
+            ):
+                await self._custom_map[call.data]["handler"](
+                    (
+                        BotInlineCall
+                        if getattr(getattr(call, "message", None), "chat", None)
+                        else InlineCall
+                    )(call, self, None),
+                    *self._custom_map[call.data].get("args", []),
+                    **self._custom_map[call.data].get("kwargs", {}),
+                )
             return
 
     async def _chosen_inline_handler(
@@ -0,0 +1,205 @@
+"""Fixed-bucket latency histograms of command pipeline stages"""
+
+# ©️ Dan Gazizullin, 2021-2023
+# This file is a part of Hikka Userbot
+# 🌐 https://github.com/hikariatama/Hikka
+# You can redistribute it and/or modify it under the terms of the GNU AGPLv3
+# 🔑 https://www.gnu.org/licenses/agpl-3.0.html
+
+import bisect
+import time
+import typing
+
+# Upper bounds of buckets in seconds: 50µs * 1.5 ** n, up to ~70 seconds.
+# Everything above the last bound falls into the overflow bucket.
+BUCKETS = tuple(0.00005 * 1.5**i for i in range(36))
+PERCENTILES = (50, 95, 99)
+
+STAGE_PARSE = "parse"
+STAGE_RATELIMIT = "ratelimit"
+STAGE_SECURITY = "security"
+STAGE_TAGS = "tags"
+STAGE_QUEUE = "queue"
+STAGE_HANDLER = "handler"
+STAGE_TOTAL = "total"
+STAGE_WATCHER = "watcher"
+
+STAGES = (
+    STAGE_PARSE,
+    STAGE_RATELIMIT,
+    STAGE_SECURITY,
+    STAGE_TAGS,
+    STAGE_QUEUE,
+    STAGE_HANDLER,
+    STAGE_TOTAL,
+    STAGE_WATCHER,
+)
+
+
+class LatencyHistogram:
+    """Latency distribution with fixed buckets, so recording is O(log buckets)"""
+
+    __slots__ = ("buckets", "count", "errors", "sum", "max")
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.errors = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float, error: bool = False):
+        """
+        Record single measurement
+        :param seconds: Measured duration
+        :param error: Whether measured call has failed
+        """
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+        if error:
+            self.errors += 1
+
+    def percentile(self, percent: float) -> float:
+        """
+        Get approximate percentile of recorded durations
+        :param percent: Percentile to get (0-100)
+        :return: Percentile in seconds, interpolated within its bucket
+        """
+        if not self.count:
+            return 0.0
+
+        rank = self.count * percent / 100
+        seen = 0
+        for i, amount in enumerate(self.buckets):
+            if amount and seen + amount >= rank:
+                if i == len(BUCKETS):
+                    return self.max
+
+                lower = BUCKETS[i - 1] if i else 0.0
+                value = lower + (BUCKETS[i] - lower) * (rank - seen) / amount
+                return min(value, self.max)
+
+            seen += amount
+
+        return self.max
+
+    def to_dict(self) -> dict:
+        """
+        Get machine-readable summary of histogram. Durations are in milliseconds
+        :return: Summary
+        """
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg": round(self.sum / self.count * 1000, 3) if self.count else 0.0,
+            "max": round(self.max * 1000, 3),
+            **{
+                f"p{percent}": round(self.percentile(percent) * 1000, 3)
+                for percent in PERCENTILES
+            },
+        }
+
+
+class LatencyTracker:
+    """Collects stage histograms per command and per module"""
+
+    def __init__(self):
+        self.started = time.time()
+        self._commands: typing.Dict[
+            typing.Tuple[str, str], typing.Dict[str, LatencyHistogram]
+        ] = {}
+        self._modules: typing.Dict[str, typing.Dict[str, LatencyHistogram]] = {}
+
+    def record(
+        self,
+        module: str,
+        command: typing.Optional[str],
+        stage: str,
+        seconds: float,
+        error: bool = False,
+    ):
+        """
+        Record stage duration
+        :param module: Module class name
+        :param command: Command name or None, if it's not a command stage
+        :param stage: Pipeline stage, one of `STAGES`
+        :param seconds: Measured duration
+        :param error: Whether stage has failed
+        """
+        if command is not None:
+            stages = self._commands.setdefault((module, command), {})
+            if (histogram := stages.get(stage)) is None:
+                histogram = stages[stage] = LatencyHistogram()
+
+            histogram.record(seconds, error)
+
+        stages = self._modules.setdefault(module, {})
+        if (histogram := stages.get(stage)) is None:
+            histogram = stages[stage] = LatencyHistogram()
+
+        histogram.record(seconds, error)
+
+    def reset(self):
+        """Drop all recorded measurements"""
+        self.started = time.time()
+        self._commands.clear()
+        self._modules.clear()
+
+    def dump(self) -> dict:
+        """
+        Get machine-readable dump of all histograms. Durations are in milliseconds
+        :return: Dump
+        """
+        return {
+            "since": round(self.started),
+            "buckets": [round(bound * 1000, 3) for bound in BUCKETS],
+            "modules": {
+                module: {
+                    stage: histogram.to_dict() for stage, histogram in stages.items()
+                }
+                for module, stages in self._modules.items()
+            },
+            "commands": {
+                f"{module}.{command}": {
+                    stage: histogram.to_dict() for stage, histogram in stages.items()
+                }
+                for (module, command), stages in self._commands.items()
+            },
+        }
+
+    def slowest(
+        self,
+        stage: str = STAGE_TOTAL,
+        percent: float = 95,
+        limit: int = 10,
+        commands: bool = False,
+    ) -> typing.List[typing.Tuple[str, str, typing.Dict[str, LatencyHistogram]]]:
+        """
+        Get modules or commands, sorted by percentile of stage duration
+        :param stage: Stage to sort by
+        :param percent: Percentile to sort by
+        :param limit: Maximum amount of entries
+        :param commands: Whether to return commands instead of modules
+        :return: List of (name, stage, stage histograms)
+        """
+        items = (
+            (
+                (f"{module}.{command}", stages)
+                for (module, command), stages in self._commands.items()
+            )
+            if commands
+            else self._modules.items()
+        )
+
+        return [
+            (name, stage, stages)
+            for name, stages in sorted(
+                (item for item in items if stage in item[1]),
+                key=lambda item: item[1][stage].percentile(percent),
+                reverse=True,
+            )[:limit]
+        ]
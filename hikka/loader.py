@@ -26,8 +26,10 @@ from uuid import uuid4
 from hikkatl.tl.tlobject import TLObject
 
 from . import security, utils, validators
+from ._context import execution_context
 from .database import Database
 from .inline.core import InlineManager
+from .routing import WatcherRouter, compile_tags
 from .translations import Strings, Translator
 from .types import (
     Command,
@@ -208,7 +210,11 @@ class InfiniteLoop:
                 break
 
             try:
-                await self.func(self.module_instance, *args, **kwargs)
+                with execution_context(
+                    getattr(self.module_instance.allmodules.client, "tg_id", None),
+                    self.module_instance,
+                ):
+                    await self.func(self.module_instance, *args, **kwargs)
             except StopLoop:
                 break
             except Exception:
@@ -488,8 +494,11 @@ class Modules:
         self.dragon_modules = []
         self.libraries = []
         self.watchers = []
+        self.watcher_router = WatcherRouter()
         self._log_handlers = []
-        self._core_commands = []
+        self._core_commands = set()
+        self._dispatch_index: typing.Dict[str, typing.Tuple[str, Command]] = {}
+        self._alias_index: typing.Dict[str, str] = {}
         self.__approve = []
         self.allclients = allclients
         self.client = client
@@ -508,29 +517,21 @@ class Modules:
         """
         while True:
             await asyncio.sleep(30)
-            commands = {}
             inline_handlers = {}
             callback_handlers = {}
             watchers = []
             for module in self.modules:
-                commands.update(module.hikka_commands)
                 inline_handlers.update(module.hikka_inline_handlers)
                 callback_handlers.update(module.hikka_callback_handlers)
                 watchers.extend(module.hikka_watchers.values())
 
-            self.commands = commands
             self.inline_handlers = inline_handlers
             self.callback_handlers = callback_handlers
             self.watchers = watchers
+            self.watcher_router.rebuild(watchers)
 
             logger.debug(
-                (
-                    "Reloaded %s commands,"
-                    " %s inline handlers,"
-                    " %s callback handlers and"
-                    " %s watchers"
-                ),
-                len(self.commands),
+                "Reloaded %s inline handlers, %s callback handlers and %s watchers",
                 len(self.inline_handlers),
                 len(self.callback_handlers),
                 len(self.watchers),
@@ -710,13 +711,15 @@ class Modules:
         """Saves aliases and applies them to <core>/<file> modules"""
         self.aliases.update(aliases)
         for alias, cmd in aliases.items():
-            self.add_alias(alias, cmd)
+            self.add_alias(alias, cmd, reindex=False)
+
+        self._reindex_commands()
 
     def register_raw_handlers(self, instance: Module):
         """Register event handlers for a module"""
         for name, handler in utils.iter_attrs(instance):
             if getattr(handler, "is_raw_handler", False):
-                self.client.dispatcher.raw_handlers.append(handler)
+                self.client.dispatcher.add_raw_handler(handler)
                 logger.debug(
                     "Registered raw handler %s for %s. ID: %s",
                     name,
@@ -736,9 +739,7 @@ class Modules:
             _hikka_client_id_logging_tag = copy.copy(self.client.tg_id)  # noqa: F841
 
         if instance.__origin__.startswith("<core"):
-            self._core_commands += list(
-                map(lambda x: x.lower(), list(instance.hikka_commands))
-            )
+            self._core_commands |= {x.lower() for x in instance.hikka_commands}
 
         for _command, cmd in instance.hikka_commands.items():
             # Restrict overwriting core modules' commands
@@ -750,14 +751,17 @@ class Modules:
                 with contextlib.suppress(Exception):
                     self.modules.remove(instance)
 
+                self._reindex_commands()
                 raise CoreOverwriteError(command=_command)
 
+            compile_tags(cmd)
             self.commands.update({_command.lower(): cmd})
 
         for alias, cmd in self.aliases.copy().items():
             if cmd in instance.hikka_commands:
-                self.add_alias(alias, cmd)
+                self.add_alias(alias, cmd, reindex=False)
 
+        self._reindex_commands()
         self.register_inline_stuff(instance)
 
     def register_inline_stuff(self, instance: Module):
@@ -836,13 +840,22 @@ class Modules:
         with contextlib.suppress(AttributeError):
             _hikka_client_id_logging_tag = copy.copy(self.client.tg_id)  # noqa: F841
 
-        for _watcher in self.watchers:
+        outdated = []
+        for _watcher in self.watchers.copy():
             if _watcher.__self__.__class__.__name__ == instance.__class__.__name__:
                 logger.debug("Removing watcher %s for update", _watcher)
                 self.watchers.remove(_watcher)
+                outdated += [_watcher]
+
+        if outdated:
+            self.watcher_router.remove(outdated)
+
+        watchers = list(instance.hikka_watchers.values())
+        for _watcher in watchers:
+            compile_tags(_watcher)
 
-        for _watcher in instance.hikka_watchers.values():
-            self.watchers += [_watcher]
+        self.watchers += watchers
+        self.watcher_router.add(watchers)
 
     def lookup(
         self,
@@ -930,6 +943,51 @@ class Modules:
 
         self.modules += [instance]
 
+    @staticmethod
+    def _get_decorator_aliases(_command: Command) -> typing.List[str]:
+        aliases = []
+        if getattr(_command, "alias", None) and not (
+            aliases := getattr(_command, "aliases", None)
+        ):
+            aliases = [_command.alias]
+
+        return aliases or []
+
+    def _reindex_commands(self):
+        """
+        Rebuilds lookup index of commands, decorator aliases and legacy aliases.
+        New index is built aside and swapped in at once, so dispatching never
+        sees partially updated index
+        """
+        alias_index = {}
+        for command_name, _command in self.commands.items():
+            for alias in self._get_decorator_aliases(_command):
+                if alias.lower() not in self._core_commands:
+                    alias_index.setdefault(alias.lower(), command_name)
+
+        dispatch_index = {
+            alias: (command_name, self.commands[command_name])
+            for alias, command_name in alias_index.items()
+        }
+
+        dispatch_index.update(
+            {
+                alias: (cmd, self.commands[cmd.lower()])
+                for alias, cmd in self.aliases.items()
+                if cmd and cmd.lower() in self.commands
+            }
+        )
+
+        dispatch_index.update(
+            {
+                command_name: (command_name, _command)
+                for command_name, _command in self.commands.items()
+            }
+        )
+
+        self._alias_index = alias_index
+        self._dispatch_index = dispatch_index
+
     def find_alias(
         self,
         alias: str,
@@ -938,22 +996,8 @@ class Modules:
         if not alias:
             return None
 
-        for command_name, _command in self.commands.items():
-            aliases = []
-            if getattr(_command, "alias", None) and not (
-                aliases := getattr(_command, "aliases", None)
-            ):
-                aliases = [_command.alias]
-
-            if not aliases:
-                continue
-
-            if any(
-                alias.lower() == _alias.lower()
-                and alias.lower() not in self._core_commands
-                for _alias in aliases
-            ):
-                return command_name
+        if command_name := self._alias_index.get(alias.lower()):
+            return command_name
 
         if alias in self.aliases and include_legacy:
             return self.aliases[alias]
@@ -962,19 +1006,12 @@ class Modules:
 
     def dispatch(self, _command: str) -> typing.Tuple[str, typing.Optional[str]]:
         """Dispatch command to appropriate module"""
+        try:
+            cmd, func = self._dispatch_index[_command.lower()]
+        except KeyError:
+            return _command, None
 
-        return next(
-            (
-                (cmd, self.commands[cmd.lower()])
-                for cmd in [
-                    _command,
-                    self.aliases.get(_command.lower()),
-                    self.find_alias(_command),
-                ]
-                if cmd and cmd.lower() in self.commands
-            ),
-            (_command, None),
-        )
+        return (_command if cmd == _command.lower() else cmd), func
 
     def send_config(self, skip_hook: bool = False):
         """Configure modules"""
@@ -1054,18 +1091,20 @@ class Modules:
 
         if from_dlmod:
             try:
-                if len(inspect.signature(mod.on_dlmod).parameters) == 2:
-                    await mod.on_dlmod(self.client, self._db)
-                else:
-                    await mod.on_dlmod()
+                with execution_context(getattr(self.client, "tg_id", None), mod):
+                    if len(inspect.signature(mod.on_dlmod).parameters) == 2:
+                        await mod.on_dlmod(self.client, self._db)
+                    else:
+                        await mod.on_dlmod()
             except Exception:
                 logger.info("Can't process `on_dlmod` hook", exc_info=True)
 
         try:
-            if len(inspect.signature(mod.client_ready).parameters) == 2:
-                await mod.client_ready(self.client, self._db)
-            else:
-                await mod.client_ready()
+            with execution_context(getattr(self.client, "tg_id", None), mod):
+                if len(inspect.signature(mod.client_ready).parameters) == 2:
+                    await mod.client_ready(self.client, self._db)
+                else:
+                    await mod.client_ready()
         except SelfUnload as e:
             if no_self_unload:
                 raise e
@@ -1155,6 +1194,7 @@ class Modules:
                 self.unregister_commands(module, "unload")
                 self.unregister_watchers(module, "unload")
                 self.unregister_inline_stuff(module, "unload")
+                self.client.dispatcher.scheduler.cancel(module.__class__.__name__)
 
         logger.debug("Worked: %s", worked)
         return worked
@@ -1184,7 +1224,10 @@ class Modules:
                     if _command == name:
                         del self.aliases[alias]
 
+        self._reindex_commands()
+
     def unregister_watchers(self, instance: Module, purpose: str):
+        outdated = []
         for _watcher in self.watchers.copy():
             if _watcher.__self__.__class__.__name__ == instance.__class__.__name__:
                 logger.debug(
@@ -1194,12 +1237,16 @@ class Modules:
                     purpose,
                 )
                 self.watchers.remove(_watcher)
+                outdated += [_watcher]
+
+        if outdated:
+            self.watcher_router.remove(outdated)
 
     def unregister_raw_handlers(self, instance: Module, purpose: str):
         """Unregister event handlers for a module"""
-        for handler in self.client.dispatcher.raw_handlers:
+        for handler in self.client.dispatcher.raw_handlers.copy():
             if handler.__self__.__class__.__name__ == instance.__class__.__name__:
-                self.client.dispatcher.raw_handlers.remove(handler)
+                self.client.dispatcher.remove_raw_handler(handler)
                 logger.debug(
                     "Unregistered raw handler of module %s for %s. ID: %s",
                     instance.__class__.__name__,
@@ -1207,17 +1254,24 @@ class Modules:
                     handler.id,
                 )
 
-    def add_alias(self, alias: str, cmd: str) -> bool:
+    def add_alias(self, alias: str, cmd: str, reindex: bool = True) -> bool:
         """Make an alias"""
         if cmd not in self.commands:
             return False
 
         self.aliases[alias.lower().strip()] = cmd
+        if reindex:
+            self._reindex_commands()
+
         return True
 
     def remove_alias(self, alias: str) -> bool:
         """Remove an alias"""
-        return bool(self.aliases.pop(alias.lower().strip(), None))
+        removed = bool(self.aliases.pop(alias.lower().strip(), None))
+        if removed:
+            self._reindex_commands()
+
+        return removed
 
     async def log(self, *args, **kwargs):
         """Unnecessary placeholder for logging"""
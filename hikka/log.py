@@ -21,6 +21,7 @@ import hikkatl
 from aiogram.utils.exceptions import NetworkError
 
 from . import utils
+from ._context import get_context
 from .tl_cache import CustomTelegramClient
 from .types import BotInlineCall, Module
 from .web.debugger import WebDebugger
@@ -425,19 +426,22 @@ class TelegramLogsHandler(logging.Handler):
 
     def emit(self, record: logging.LogRecord):
         try:
-            caller = next(
-                (
-                    frame_info.frame.f_locals["_hikka_client_id_logging_tag"]
-                    for frame_info in inspect.stack()
-                    if isinstance(
-                        getattr(getattr(frame_info, "frame", None), "f_locals", {}).get(
-                            "_hikka_client_id_logging_tag"
-                        ),
-                        int,
-                    )
-                ),
-                False,
-            )
+            if (context := get_context()) and context.client_id is not None:
+                caller = context.client_id
+            else:
+                caller = next(
+                    (
+                        frame_info.frame.f_locals["_hikka_client_id_logging_tag"]
+                        for frame_info in inspect.stack(0)
+                        if isinstance(
+                            getattr(
+                                getattr(frame_info, "frame", None), "f_locals", {}
+                            ).get("_hikka_client_id_logging_tag"),
+                            int,
+                        )
+                    ),
+                    False,
+                )
 
             if not isinstance(caller, int):
                 caller = None
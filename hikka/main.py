@@ -59,6 +59,7 @@ from hikkatl.tl.functions.account import GetPasswordRequest
 from hikkatl.tl.functions.auth import CheckPasswordRequest
 
 from . import database, loader, utils, version
+from ._cache_snapshot import CacheSnapshot
 from ._internal import print_banner
 from .dispatcher import CommandDispatcher
 from .qr import QRCode
@@ -846,11 +847,24 @@ class Hikka:
         client.parse_mode = "HTML"
         await client.start()
 
+        if web_db := getattr(client, "hikka_db", None):
+            # Database, created during web auth, may still have pending changes
+            await web_db.flush()
+
         db = database.Database(client)
         client.hikka_db = db
         await db.init()
 
         logging.debug("Got DB")
+
+        client.hikka_cache_snapshot = None
+        if not get_config_key("disable_cache_snapshot"):
+            client.hikka_cache_snapshot = CacheSnapshot(
+                client,
+                BASE_PATH / f"cache-{client.tg_id}.db",
+            )
+            client.hikka_cache_snapshot.start()
+
         logging.debug("Loading logging config...")
 
         translator = Translator(client, db)
@@ -880,6 +894,11 @@ class Hikka:
 
         await client.run_until_disconnected()
 
+        if client.hikka_cache_snapshot:
+            await client.hikka_cache_snapshot.stop()
+
+        await db.flush()
+
     async def _main(self):
         """Main entrypoint"""
         self._init_web()
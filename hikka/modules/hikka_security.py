@@ -274,6 +274,10 @@ class HikkaSecurityMod(loader.Module):
             await utils.answer(message, self.strings("sgroup_not_found").format(args))
             return
 
+        users = [
+            user for user in await self._client.get_entities(group.users, exp=0) if user
+        ]
+
         await utils.answer(
             message,
             self.strings("sgroup_info").format(
@@ -283,20 +287,14 @@ class HikkaSecurityMod(loader.Module):
                         "\n".join(
                             [
                                 self.strings("li").format(
-                                    utils.get_entity_url(
-                                        await self._client.get_entity(user, exp=0)
-                                    ),
-                                    utils.escape_html(
-                                        get_display_name(
-                                            await self._client.get_entity(user, exp=0)
-                                        )
-                                    ),
+                                    utils.get_entity_url(user),
+                                    utils.escape_html(get_display_name(user)),
                                 )
-                                for user in group.users
+                                for user in users
                             ]
                         )
                     )
-                    if group.users
+                    if users
                     else self.strings("no_users")
                 ),
                 (
@@ -620,10 +618,14 @@ class HikkaSecurityMod(loader.Module):
 
     @loader.command()
     async def ownerlist(self, message: Message):
-        _resolved_users = []
-        for user in set(self._client.dispatcher.security.owner + [self.tg_id]):
-            with contextlib.suppress(Exception):
-                _resolved_users += [await self._client.get_entity(user, exp=0)]
+        _resolved_users = [
+            user
+            for user in await self._client.get_entities(
+                set(self._client.dispatcher.security.owner + [self.tg_id]),
+                exp=0,
+            )
+            if user
+        ]
 
         if not _resolved_users:
             await utils.answer(message, self.strings("no_owner"))
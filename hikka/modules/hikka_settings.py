@@ -395,10 +395,12 @@ class HikkaSettingsMod(loader.Module):
     @loader.command()
     async def nonickusers(self, message: Message):
         users = []
-        for user_id in self._db.get(main.__name__, "nonickusers", []).copy():
-            try:
-                user = await self._client.get_entity(user_id)
-            except Exception:
+        user_ids = self._db.get(main.__name__, "nonickusers", []).copy()
+        for user_id, user in zip(
+            user_ids,
+            await self._client.get_entities(user_ids),
+        ):
+            if not user:
                 self._db.set(
                     main.__name__,
                     "nonickusers",
@@ -432,10 +434,12 @@ class HikkaSettingsMod(loader.Module):
     @loader.command()
     async def nonickchats(self, message: Message):
         chats = []
-        for chat in self._db.get(main.__name__, "nonickchats", []):
-            try:
-                chat_entity = await self._client.get_entity(int(chat))
-            except Exception:
+        chat_ids = self._db.get(main.__name__, "nonickchats", []).copy()
+        for chat, chat_entity in zip(
+            chat_ids,
+            await self._client.get_entities(map(int, chat_ids)),
+        ):
+            if not chat_entity:
                 self._db.set(
                     main.__name__,
                     "nonickchats",
@@ -875,21 +879,21 @@ class HikkaSettingsMod(loader.Module):
                 result = (
                     f"Dropped {len(self._client._hikka_entity_cache)} cache records"
                 )
-                self._client._hikka_entity_cache = {}
+                self._client._hikka_entity_cache.clear()
             elif method == "flush_fulluser_cache":
                 result = (
                     f"Dropped {len(self._client._hikka_fulluser_cache)} cache records"
                 )
-                self._client._hikka_fulluser_cache = {}
+                self._client._hikka_fulluser_cache.clear()
             elif method == "flush_fullchannel_cache":
                 result = (
                     f"Dropped {len(self._client._hikka_fullchannel_cache)} cache"
                     " records"
                 )
-                self._client._hikka_fullchannel_cache = {}
+                self._client._hikka_fullchannel_cache.clear()
             elif method == "flush_perms_cache":
                 result = f"Dropped {len(self._client._hikka_perms_cache)} cache records"
-                self._client._hikka_perms_cache = {}
+                self._client._hikka_perms_cache.clear()
             elif method == "flush_loader_cache":
                 result = (
                     f"Dropped {await self.lookup('loader').flush_cache()} cache records"
@@ -905,9 +909,9 @@ class HikkaSettingsMod(loader.Module):
                     " records\nDropped"
                     f" {count} loader links cache records"
                 )
-                self._client._hikka_entity_cache = {}
-                self._client._hikka_fulluser_cache = {}
-                self._client._hikka_fullchannel_cache = {}
+                self._client._hikka_entity_cache.clear()
+                self._client._hikka_fulluser_cache.clear()
+                self._client._hikka_fullchannel_cache.clear()
                 self._client.hikka_me = await self._client.get_me()
             elif method == "reload_core":
                 core_quantity = await self.lookup("loader").reload_core()
@@ -921,6 +925,18 @@ class HikkaSettingsMod(loader.Module):
                     f" {len(self._client._hikka_fullchannel_cache)} records\nLoader"
                     f" links cache: {self.lookup('loader').inspect_cache()} records"
                 )
+                for name, stats in self._client.hikka_cache_stats().items():
+                    result += (
+                        f"\n{name}: {stats['hits']} hits, {stats['misses']} misses,"
+                        f" {stats['evictions']} evictions, {stats['size']} records"
+                    )
+                    if "stale_hits" in stats:
+                        result += (
+                            f", {stats['stale_hits']} stale hits,"
+                            f" {stats['refreshes']} refreshes"
+                            f" ({stats['refresh_errors']} failed), max stale age"
+                            f" {round(stats['max_stale_age'])}s"
+                        )
             elif method == "inspect_modules":
                 result = (
                     "Loaded modules: {}\nLoaded core modules: {}\nLoaded user"
@@ -161,8 +161,14 @@ class LoaderMod(loader.Module):
                 delattr(lib.config._config[option], "_save_marker")
                 lib._lib_pointer("__config__", {})[option] = config.value
 
+        # Writes owners, which were changed without `set`, e.g. with `mark_dirty`
         self._db.save()
 
+    @loader.loop(interval=10 * 60, wait_before=True, autostart=True)
+    async def _full_db_saver(self):
+        # Catches values, which were changed in-place without `mark_dirty`
+        self._db.save(full=True)
+
     def update_modules_in_db(self):
         if self.allmodules.secure_boot:
             return
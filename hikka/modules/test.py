@@ -5,6 +5,7 @@
 # 🔑 https://www.gnu.org/licenses/agpl-3.0.html
 
 import inspect
+import json
 import logging
 import os
 import random
@@ -15,6 +16,7 @@ from io import BytesIO
 from hikkatl.tl.types import Message
 
 from .. import loader, main, utils
+from ..latency import STAGE_TOTAL, STAGE_WATCHER, STAGES
 from ..inline.types import InlineCall
 
 logger = logging.getLogger(__name__)
@@ -364,6 +366,67 @@ class TestMod(loader.Module):
             ),
         )
 
+    @loader.command()
+    async def latency(self, message: Message):
+        tracker = self._client.dispatcher.latency
+        args = utils.get_args_raw(message).lower()
+
+        if args == "reset":
+            tracker.reset()
+            await utils.answer(message, self.strings("latency_reset"))
+            return
+
+        if args == "json":
+            dump = {
+                **tracker.dump(),
+                "security": self._client.dispatcher.security.cache_stats(),
+                "scheduler": self._client.dispatcher.scheduler.stats(),
+            }
+            dump = BytesIO(json.dumps(dump, indent=4).encode())
+            dump.name = "hikka-latency.json"
+            await utils.answer(message, dump, caption=self.strings("latency_caption"))
+            return
+
+        commands = args == "commands"
+        entries = tracker.slowest(STAGE_TOTAL, commands=commands)
+        if not commands:
+            # Modules with both commands and watchers are listed once, and
+            # their watcher stage goes to the breakdown
+            listed = {name for name, _, _ in entries}
+            entries += [
+                entry
+                for entry in tracker.slowest(STAGE_WATCHER)
+                if entry[0] not in listed
+            ]
+
+        if not entries:
+            await utils.answer(message, self.strings("latency_empty"))
+            return
+
+        lines = []
+        for name, stage, stages in entries:
+            lines.append(
+                self.strings("latency_entry").format(
+                    name=utils.escape_html(name),
+                    stage=stage,
+                    **stages[stage].to_dict(),
+                )
+            )
+            if breakdown := " · ".join(
+                f"{key} {stages[key].to_dict()['p95']}"
+                for key in STAGES
+                if key in stages and key != stage
+            ):
+                lines.append(self.strings("latency_stages").format(breakdown))
+
+        await utils.answer(
+            message,
+            self.strings("latency").format(
+                time.strftime("%d.%m.%Y %H:%M:%S", time.localtime(tracker.started)),
+                "\n".join(lines),
+            ),
+        )
+
     async def client_ready(self):
         chat, _ = await utils.asset_channel(
             self._client,
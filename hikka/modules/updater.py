@@ -119,7 +119,12 @@ class UpdaterMod(loader.Module):
 
         self.set("restart_ts", time.time())
 
-        await self._db.remote_force_save()
+        for client in self.allclients:
+            await client.hikka_db.flush()
+
+        for client in self.allclients:
+            if snapshot := getattr(client, "hikka_cache_snapshot", None):
+                await snapshot.stop()
 
         if "LAVHOST" in os.environ:
             os.system("lavhost restart")
@@ -0,0 +1,414 @@
+"""Routes incoming events to watchers, which can possibly accept them"""
+
+# ©️ Dan Gazizullin, 2021-2023
+# This file is a part of Hikka Userbot
+# 🌐 https://github.com/hikariatama/Hikka
+# You can redistribute it and/or modify it under the terms of the GNU AGPLv3
+# 🔑 https://www.gnu.org/licenses/agpl-3.0.html
+
+import contextlib
+import itertools
+import logging
+import re
+import typing
+
+from hikkatl.tl.types import Message
+
+from . import utils
+from .tl_cache import hashable
+from .types import Command
+
+logger = logging.getLogger(__name__)
+
+ALL_TAGS = [
+    "no_commands",
+    "only_commands",
+    "out",
+    "in",
+    "only_messages",
+    "editable",
+    "no_media",
+    "only_media",
+    "only_photos",
+    "only_videos",
+    "only_audios",
+    "only_docs",
+    "only_stickers",
+    "only_inline",
+    "only_channels",
+    "only_groups",
+    "only_pm",
+    "no_pm",
+    "no_channels",
+    "no_groups",
+    "no_inline",
+    "no_stickers",
+    "no_docs",
+    "no_audios",
+    "no_videos",
+    "no_photos",
+    "no_forwards",
+    "no_reply",
+    "no_mention",
+    "mention",
+    "only_reply",
+    "only_forwards",
+    "startswith",
+    "endswith",
+    "contains",
+    "regex",
+    "filter",
+    "from_id",
+    "chat_id",
+    "thumb_url",
+    "alias",
+    "aliases",
+]
+
+
+def normalize_chat_id(chat_id: typing.Any) -> typing.Any:
+    """
+    Strips `-100` prefix from chat id passed to `chat_id` tag
+    :param chat_id: Chat id from tag
+    :return: Chat id in the same format as `utils.get_chat_id` returns
+    """
+    return chat_id if not str(chat_id).startswith("-100") else int(str(chat_id)[4:])
+
+
+# Each check receives the message and the handler, which carries tag values
+TAG_CHECKS: typing.Dict[str, typing.Callable[[Message, Command], typing.Any]] = {
+    "out": lambda m, _: getattr(m, "out", True),
+    "in": lambda m, _: not getattr(m, "out", True),
+    "only_messages": lambda m, _: isinstance(m, Message),
+    "editable": (
+        lambda m, _: not getattr(m, "out", False)
+        and not getattr(m, "fwd_from", False)
+        and not getattr(m, "sticker", False)
+        and not getattr(m, "via_bot_id", False)
+    ),
+    "no_media": lambda m, _: (
+        not isinstance(m, Message) or not getattr(m, "media", False)
+    ),
+    "only_media": lambda m, _: isinstance(m, Message) and getattr(m, "media", False),
+    "only_photos": lambda m, _: utils.mime_type(m).startswith("image/"),
+    "only_videos": lambda m, _: utils.mime_type(m).startswith("video/"),
+    "only_audios": lambda m, _: utils.mime_type(m).startswith("audio/"),
+    "only_stickers": lambda m, _: getattr(m, "sticker", False),
+    "only_docs": lambda m, _: getattr(m, "document", False),
+    "only_inline": lambda m, _: getattr(m, "via_bot_id", False),
+    "only_channels": lambda m, _: (
+        getattr(m, "is_channel", False) and not getattr(m, "is_group", False)
+    ),
+    "no_channels": lambda m, _: not getattr(m, "is_channel", False),
+    "no_groups": (
+        lambda m, _: not getattr(m, "is_group", False)
+        or getattr(m, "private", False)
+        or getattr(m, "is_channel", False)
+    ),
+    "only_groups": (
+        lambda m, _: getattr(m, "is_group", False)
+        or not getattr(m, "private", False)
+        and not getattr(m, "is_channel", False)
+    ),
+    "no_pm": lambda m, _: not getattr(m, "private", False),
+    "only_pm": lambda m, _: getattr(m, "private", False),
+    "no_inline": lambda m, _: not getattr(m, "via_bot_id", False),
+    "no_stickers": lambda m, _: not getattr(m, "sticker", False),
+    "no_docs": lambda m, _: not getattr(m, "document", False),
+    "no_audios": lambda m, _: not utils.mime_type(m).startswith("audio/"),
+    "no_videos": lambda m, _: not utils.mime_type(m).startswith("video/"),
+    "no_photos": lambda m, _: not utils.mime_type(m).startswith("image/"),
+    "no_forwards": lambda m, _: not getattr(m, "fwd_from", False),
+    "no_reply": lambda m, _: not getattr(m, "reply_to_msg_id", False),
+    "only_forwards": lambda m, _: getattr(m, "fwd_from", False),
+    "only_reply": lambda m, _: getattr(m, "reply_to_msg_id", False),
+    "mention": lambda m, _: getattr(m, "mentioned", False),
+    "no_mention": lambda m, _: not getattr(m, "mentioned", False),
+    "startswith": lambda m, func: (
+        isinstance(m, Message) and m.raw_text.startswith(func.startswith)
+    ),
+    "endswith": lambda m, func: (
+        isinstance(m, Message) and m.raw_text.endswith(func.endswith)
+    ),
+    "contains": lambda m, func: isinstance(m, Message) and func.contains in m.raw_text,
+    "filter": lambda m, func: callable(func.filter) and func.filter(m),
+    "from_id": lambda m, func: getattr(m, "sender_id", None) == func.from_id,
+    "chat_id": lambda m, func: utils.get_chat_id(m) == normalize_chat_id(func.chat_id),
+    "regex": lambda m, func: (
+        isinstance(m, Message) and re.search(func.regex, m.raw_text)
+    ),
+}
+
+# Tags, which depend on message itself, by evaluation cost
+DYNAMIC_TAGS_COST = {
+    "from_id": 0,
+    "chat_id": 1,
+    "startswith": 2,
+    "endswith": 2,
+    "contains": 3,
+    "regex": 4,
+    "filter": 5,
+}
+
+# Tags, which result depends only on `event_class` of the message
+STATIC_TAGS = tuple(
+    tag for tag in ALL_TAGS if tag in TAG_CHECKS and tag not in DYNAMIC_TAGS_COST
+)
+
+MAX_EVENT_CLASSES = 1024
+
+
+def event_class(m: Message) -> tuple:
+    """
+    Reduces message to the set of flags, which static tags depend on.
+    Two messages of the same class pass exactly the same static tags
+    :param m: Message to classify
+    :return: Hashable class of the message
+    """
+    mime = utils.mime_type(m)
+    return (
+        isinstance(m, Message),
+        bool(getattr(m, "out", False)),
+        # `out` and `in` tags treat messages without `out` as outgoing
+        hasattr(m, "out"),
+        bool(getattr(m, "is_channel", False)),
+        bool(getattr(m, "is_group", False)),
+        bool(getattr(m, "private", False)),
+        bool(getattr(m, "media", False)),
+        mime[: mime.find("/") + 1],
+        bool(getattr(m, "sticker", False)),
+        bool(getattr(m, "document", False)),
+        bool(getattr(m, "via_bot_id", False)),
+        bool(getattr(m, "fwd_from", False)),
+        bool(getattr(m, "reply_to_msg_id", False)),
+        bool(getattr(m, "mentioned", False)),
+    )
+
+
+TagCheck = typing.Tuple[str, typing.Callable[[Message], typing.Any]]
+
+
+class TagPlan(typing.NamedTuple):
+    """
+    Compiled tag filter of a handler. Checks are ordered from the cheapest to
+    the most expensive one, so the event is rejected as early as possible.
+    Command checks are the most expensive ones, so they are done by
+    dispatcher after all the others
+    """
+
+    static: typing.Tuple[TagCheck, ...]
+    dynamic: typing.Tuple[TagCheck, ...]
+    checks: typing.Tuple[TagCheck, ...]
+    no_commands: bool
+    only_commands: bool
+
+    def first_failed(self, m: Message, routed: bool = False) -> typing.Optional[str]:
+        """
+        Evaluates all non-command checks of the plan
+        :param m: Message to check
+        :param routed: Whether message was routed by `WatcherRouter`,
+            so static checks are known to pass
+        :return: The tag, which failed, or None
+        """
+        return next(
+            (
+                tag
+                for tag, check in (self.dynamic if routed else self.checks)
+                if not check(m)
+            ),
+            None,
+        )
+
+
+def _bind(tag: str, func: Command) -> typing.Callable[[Message], typing.Any]:
+    """Binds tag check to the value of tag, so it's not looked up on each event"""
+    value = getattr(func, tag)
+
+    if tag == "startswith":
+        return lambda m: isinstance(m, Message) and m.raw_text.startswith(value)
+
+    if tag == "endswith":
+        return lambda m: isinstance(m, Message) and m.raw_text.endswith(value)
+
+    if tag == "contains":
+        return lambda m: isinstance(m, Message) and value in m.raw_text
+
+    if tag == "regex":
+        try:
+            pattern = re.compile(value)
+        except (re.error, TypeError):
+            logger.error("Invalid regex tag %s of %s, it will never match", value, func)
+            return lambda _: False
+
+        return lambda m: isinstance(m, Message) and pattern.search(m.raw_text)
+
+    if tag == "filter":
+        return lambda m: callable(value) and value(m)
+
+    if tag == "from_id":
+        return lambda m: getattr(m, "sender_id", None) == value
+
+    if tag == "chat_id":
+        chat_id = normalize_chat_id(value)
+        return lambda m: utils.get_chat_id(m) == chat_id
+
+    check = TAG_CHECKS[tag]
+    return lambda m: check(m, func)
+
+
+def compile_tags(func: Command) -> TagPlan:
+    """
+    Compiles tags of the handler to the `TagPlan` and attaches it to
+    the handler as `tag_plan` attribute
+    :param func: Handler to compile tags of
+    :return: Compiled plan
+    """
+    tags = [tag for tag in ALL_TAGS if tag in TAG_CHECKS and getattr(func, tag, False)]
+    static = tuple((tag, _bind(tag, func)) for tag in tags if tag in STATIC_TAGS)
+    dynamic = tuple(
+        (tag, _bind(tag, func))
+        for tag in sorted(
+            (tag for tag in tags if tag in DYNAMIC_TAGS_COST),
+            key=DYNAMIC_TAGS_COST.get,
+        )
+    )
+    plan = TagPlan(
+        static=static,
+        dynamic=dynamic,
+        checks=static + dynamic,
+        no_commands=bool(getattr(func, "no_commands", False)),
+        only_commands=bool(getattr(func, "only_commands", False)),
+    )
+
+    with contextlib.suppress(AttributeError):
+        getattr(func, "__func__", func).tag_plan = plan
+
+    return plan
+
+
+def get_tag_plan(func: Command) -> TagPlan:
+    """
+    Get compiled tags of the handler, compiling them if handler
+    was not registered via loader
+    :param func: Handler to get plan of
+    :return: Compiled plan
+    """
+    return getattr(func, "tag_plan", None) or compile_tags(func)
+
+
+class _Route(typing.NamedTuple):
+    seq: int
+    func: Command
+    plan: TagPlan
+
+    def accepts(self, m: Message) -> bool:
+        return all(check(m) for _, check in self.plan.static)
+
+
+class WatcherRouter:
+    """
+    Precompiled routing table for watchers. Watchers are bucketed by
+    `from_id` and `chat_id` tags, the rest of them are grouped by event class,
+    so each event visits only candidates, which pass its static tags.
+    Dynamic tags (regex, filter, commands etc.) must still be checked by caller
+    """
+
+    def __init__(self):
+        self._seq = itertools.count()
+        self._routes: typing.List[_Route] = []
+        self._generic: typing.List[_Route] = []
+        self._by_from_id: typing.Dict[typing.Any, typing.List[_Route]] = {}
+        self._by_chat_id: typing.Dict[typing.Any, typing.List[_Route]] = {}
+        self._classes: typing.Dict[tuple, typing.List[_Route]] = {}
+
+    def __len__(self) -> int:
+        return len(self._routes)
+
+    def _reindex(self):
+        self._generic = []
+        self._by_from_id = {}
+        self._by_chat_id = {}
+        self._classes = {}
+
+        for route in self._routes:
+            if getattr(route.func, "from_id", False) and hashable(route.func.from_id):
+                self._by_from_id.setdefault(route.func.from_id, []).append(route)
+            elif getattr(route.func, "chat_id", False) and hashable(
+                normalize_chat_id(route.func.chat_id)
+            ):
+                self._by_chat_id.setdefault(
+                    normalize_chat_id(route.func.chat_id),
+                    [],
+                ).append(route)
+            else:
+                self._generic.append(route)
+
+    def _route(self, func: Command) -> _Route:
+        return _Route(next(self._seq), func, get_tag_plan(func))
+
+    def rebuild(self, watchers: typing.Iterable[Command]):
+        """
+        Rebuilds routing table from scratch
+        :param watchers: All registered watchers
+        """
+        self._routes = [self._route(func) for func in watchers]
+        self._reindex()
+
+    def add(self, watchers: typing.Iterable[Command]):
+        """
+        Adds watchers to routing table
+        :param watchers: Watchers to add
+        """
+        self._routes += [self._route(func) for func in watchers]
+        self._reindex()
+
+    def remove(self, watchers: typing.Iterable[Command]):
+        """
+        Removes watchers from routing table
+        :param watchers: Watchers to remove
+        """
+        watchers = list(watchers)
+        self._routes = [route for route in self._routes if route.func not in watchers]
+        self._reindex()
+
+    def candidates(self, m: Message) -> typing.List[Command]:
+        """
+        Get watchers, which can possibly accept the message
+        :param m: Message to route
+        :return: Watchers in registration order
+        """
+        key = event_class(m)
+
+        try:
+            generic = self._classes[key]
+        except KeyError:
+            if len(self._classes) >= MAX_EVENT_CLASSES:
+                self._classes.clear()
+
+            generic = self._classes[key] = [
+                route for route in self._generic if route.accepts(m)
+            ]
+
+        extra = []
+
+        if self._by_from_id:
+            extra += [
+                route
+                for route in self._by_from_id.get(getattr(m, "sender_id", None), [])
+                if route.accepts(m)
+            ]
+
+        if self._by_chat_id:
+            try:
+                chat_id = utils.get_chat_id(m)
+            except Exception:
+                chat_id = None
+
+            extra += [
+                route for route in self._by_chat_id.get(chat_id, []) if route.accepts(m)
+            ]
+
+        if not extra:
+            return [route.func for route in generic]
+
+        return [route.func for route in sorted(generic + extra)]
@@ -22,18 +22,19 @@
 # You can redistribute it and/or modify it under the terms of the GNU AGPLv3
 # 🔑 https://www.gnu.org/licenses/agpl-3.0.html
 
+import heapq
 import logging
+import math
 import time
 import typing
 
 from hikkatl.hints import EntityLike
-from hikkatl.tl.functions.messages import GetFullChatRequest
-from hikkatl.tl.types import ChatParticipantAdmin, ChatParticipantCreator, Message
+from hikkatl.tl.types import Message
 from hikkatl.utils import get_display_name
 
 from . import main, utils
 from .database import Database
-from .tl_cache import CustomTelegramClient
+from .tl_cache import CustomTelegramClient, LRUCache
 from .types import Command
 
 logger = logging.getLogger(__name__)
@@ -84,6 +85,11 @@ PUBLIC_PERMISSIONS = GROUP_OWNER | GROUP_ADMIN_ANY | GROUP_MEMBER | PM
 ALL = (1 << 13) - 1
 
 
+RuleKey = typing.Tuple[int, str, str]
+
+DECISIONS_LIMIT = 4096
+
+
 class SecurityGroup(typing.NamedTuple):
     """Represents a security group"""
 
@@ -168,9 +174,23 @@ class SecurityManager:
     def __init__(self, client: CustomTelegramClient, db: Database):
         self._client = client
         self._db = db
-        self._cache: typing.Dict[int, dict] = {}
+        self._cache = LRUCache(max_size=1024)
         self._last_warning: int = 0
         self._sgroups: typing.Dict[str, SecurityGroup] = {}
+        self._sgroup_rules: typing.Dict[int, typing.Set[typing.Tuple[str, str]]] = {}
+        self._user_rules: typing.Set[RuleKey] = set()
+        self._chat_rules: typing.Set[RuleKey] = set()
+        self._rules_expiry: typing.List[int] = []
+        self._rules_generation: int = -1
+        self._sgroups_generation: int = 0
+        self._decisions: typing.Dict[tuple, typing.Tuple[bool, float]] = {}
+        self._decisions_generation: int = -1
+        # (user, chat) -> keys of its decisions, so they can be dropped at once
+        self._decisions_index: typing.Dict[tuple, typing.Set[tuple]] = {}
+        self._decision_hits: int = 0
+        self._decision_misses: int = 0
+        self._flags: typing.Dict[typing.Union[Command, int], int] = {}
+        self._flags_generation: int = -1
 
         self._any_admin = self.any_admin = db.get(__name__, "any_admin", False)
         self._default = self.default = db.get(__name__, "default", DEFAULT_PERMISSIONS)
@@ -183,23 +203,118 @@ class SecurityManager:
     def apply_sgroups(self, sgroups: typing.Dict[str, SecurityGroup]):
         """Apply security groups"""
         self._sgroups = sgroups
+        sgroup_rules = {}
+        for info in sgroups.values():
+            for user_id in info.users:
+                sgroup_rules.setdefault(user_id, set()).update(
+                    (permission["rule_type"], permission["rule"])
+                    for permission in info.permissions
+                )
+
+        self._sgroup_rules = sgroup_rules
+        self._sgroups_generation += 1
+
+    @property
+    def generation(self) -> int:
+        """
+        Security generation. Changes whenever owners, masks, targeted rules,
+        security groups or blacklisted users change, so memoized decisions
+        are dropped
+        """
+        return (
+            self._db.generation(__name__)
+            + self._db.generation(main.__name__)
+            + self._sgroups_generation
+        )
+
+    def cache_stats(self) -> dict:
+        """
+        Get statistics of permission decisions cache
+
+        :return: Hits, misses, hit rate and size of cache
+        """
+        total = self._decision_hits + self._decision_misses
+        return {
+            "hits": self._decision_hits,
+            "misses": self._decision_misses,
+            "hit_rate": round(self._decision_hits / total, 4) if total else 0.0,
+            "size": len(self._decisions),
+            "generation": self.generation,
+        }
 
     def _reload_rights(self):
         """
         Internal method to ensure that account owner is always in the owner list
-        and to clear out outdated tsec rules
+        and to clear out outdated tsec rules. Rule index is rebuilt only if
+        security settings were changed, and persisted rules are purged only
+        when the earliest of them has actually expired
         """
 
-        if self._client.tg_id not in self._owner:
-            self._owner.append(self._client.tg_id)
+        if self._db.generation(__name__) != self._rules_generation:
+            if self._client.tg_id not in self._owner:
+                self._owner.append(self._client.tg_id)
+
+            self._reindex_rules()
+
+        if self._rules_expiry and self._rules_expiry[0] < time.time():
+            self._purge_expired_rules()
+
+    def _reindex_rules(self):
+        """Rebuild in-memory index of targeted rules from persisted ones"""
+        self._user_rules = {
+            (info["target"], info["rule_type"], info["rule"])
+            for info in self._tsec_user
+        }
+        self._chat_rules = {
+            (info["target"], info["rule_type"], info["rule"])
+            for info in self._tsec_chat
+        }
+
+        expiry = [
+            info["expires"]
+            for rules in (self._tsec_user, self._tsec_chat)
+            for info in rules
+            if info["expires"]
+        ]
+        heapq.heapify(expiry)
+        self._rules_expiry = expiry
+        self._rules_generation = self._db.generation(__name__)
+
+    def _purge_expired_rules(self):
+        """Remove expired targeted rules from database in a single write per list"""
+        now = time.time()
+        for rules in (self._tsec_user, self._tsec_chat):
+            if any(info["expires"] and info["expires"] < now for info in rules):
+                rules[:] = [
+                    info
+                    for info in rules
+                    if not info["expires"] or info["expires"] >= now
+                ]
+
+        self._reindex_rules()
+
+    def _match_rules(
+        self,
+        rules: typing.Set[RuleKey],
+        target: int,
+        command: typing.Optional[str],
+        module: typing.Optional[str],
+    ) -> typing.Optional[str]:
+        """
+        Find targeted rule, which allows command or module
+        :param rules: Rule index to look in
+        :param target: Target entity ID
+        :param command: Command name
+        :param module: Module class name
+        :return: Matched command or module name, or None
+        """
+        if (target, "command", command) in rules:
+            return command
 
-        for info in self._tsec_user.copy():
-            if info["expires"] and info["expires"] < time.time():
-                self._tsec_user.remove(info)
+        if module is not None and (target, "module", module) in rules:
+            return module
 
-        for info in self._tsec_chat.copy():
-            if info["expires"] and info["expires"] < time.time():
-                self._tsec_chat.remove(info)
+        return None
 
     def add_rule(
         self,
@@ -250,20 +365,10 @@ class SecurityManager:
         :return: True if any rules were removed
         """
 
-        any_ = False
-
-        if target_type == "user":
-            for rule in self.tsec_user.copy():
-                if rule["target"] == target_id:
-                    self.tsec_user.remove(rule)
-                    any_ = True
-        elif target_type == "chat":
-            for rule in self.tsec_chat.copy():
-                if rule["target"] == target_id:
-                    self.tsec_chat.remove(rule)
-                    any_ = True
-
-        return any_
+        return self._remove_rules(
+            target_type,
+            lambda rule: rule["target"] == target_id,
+        )
 
     def remove_rule(self, target_type: str, target_id: int, rule_cont: str) -> bool:
         """
@@ -275,20 +380,25 @@ class SecurityManager:
         :return: True if any rules were removed
         """
 
-        any_ = False
+        return self._remove_rules(
+            target_type,
+            lambda rule: rule["target"] == target_id and rule["rule"] == rule_cont,
+        )
 
+    def _remove_rules(self, target_type: str, predicate: callable) -> bool:
         if target_type == "user":
-            for rule in self.tsec_user.copy():
-                if rule["target"] == target_id and rule["rule"] == rule_cont:
-                    self.tsec_user.remove(rule)
-                    any_ = True
+            rules = self.tsec_user
         elif target_type == "chat":
-            for rule in self.tsec_chat.copy():
-                if rule["target"] == target_id and rule["rule"] == rule_cont:
-                    self.tsec_chat.remove(rule)
-                    any_ = True
+            rules = self.tsec_chat
+        else:
+            return False
+
+        kept = [rule for rule in rules if not predicate(rule)]
+        if len(kept) == len(rules):
+            return False
 
-        return any_
+        rules[:] = kept
+        return True
 
     def get_flags(self, func: typing.Union[Command, int]) -> int:
         """
@@ -298,6 +408,24 @@ class SecurityManager:
         :return: security flags
         """
 
+        if (generation := self._db.generation(__name__)) != self._flags_generation:
+            self._flags.clear()
+            self._flags_generation = generation
+
+        try:
+            return self._flags[func]
+        except KeyError:
+            pass
+        except TypeError:
+            return self._get_flags(func)
+
+        if len(self._flags) >= DECISIONS_LIMIT:
+            self._flags.clear()
+
+        self._flags[func] = config = self._get_flags(func)
+        return config
+
+    def _get_flags(self, func: typing.Union[Command, int]) -> int:
         if isinstance(func, int):
             config = func
         else:
@@ -325,39 +453,28 @@ class SecurityManager:
         :return: True if permitted, False otherwise
         """
 
-        return command and any(
-            (
-                rule["target"] == user_id
-                and rule["rule_type"] == "inline"
-                and rule["rule"] == command
-            )
-            for rule in self._tsec_user
-        )
+        return command and (user_id, "inline", command) in self._user_rules
 
     def check_tsec(self, user_id: int, command: str) -> bool:
-        for info in self._sgroups.copy().values():
-            if user_id in info.users:
-                for permission in info.permissions:
-                    if (
-                        permission["rule_type"] == "command"
-                        and permission["rule"] == command
-                        or permission["rule_type"] == "module"
-                        and permission["rule"] == command
-                    ):
-                        return True
-
-        for info in self._tsec_user.copy():
-            if info["target"] == user_id and (
-                info["rule_type"] == "command"
-                and info["rule"] == command
-                or info["rule_type"] == "module"
-                and command in self._client.loader.commands
-                and info["rule"]
-                == self._client.loader.commands[command].__qualname__.split(".")[0]
-            ):
-                return True
+        self._reload_rights()
 
-        return False
+        if (sgroup_rules := self._sgroup_rules.get(user_id)) and (
+            ("command", command) in sgroup_rules or ("module", command) in sgroup_rules
+        ):
+            return True
+
+        return bool(
+            self._match_rules(
+                self._user_rules,
+                user_id,
+                command,
+                (
+                    self._client.loader.commands[command].__qualname__.split(".")[0]
+                    if command in self._client.loader.commands
+                    else None
+                ),
+            )
+        )
 
     async def check(
         self,
@@ -380,6 +497,11 @@ class SecurityManager:
 
         self._reload_rights()
 
+        if (generation := self.generation) != self._decisions_generation:
+            self._decisions.clear()
+            self._decisions_index.clear()
+            self._decisions_generation = generation
+
         if not (config := self.get_flags(func)):
             return False
 
@@ -393,15 +515,16 @@ class SecurityManager:
             and message.is_channel
             and not message.is_group
             and message.edit_date
+            and (
+                editor := await self._client.get_edit_author(
+                    utils.get_chat_id(message),
+                    message.id,
+                    message.edit_date,
+                )
+            )
         ):
-            async for event in self._client.iter_admin_log(
-                utils.get_chat_id(message),
-                limit=10,
-                edit=True,
-            ):
-                if event.action.prev_message.id == message.id:
-                    user_id = event.user_id
-                    is_channel = True
+            user_id = editor
+            is_channel = True
 
         if (
             user_id == self._client.tg_id
@@ -410,6 +533,81 @@ class SecurityManager:
         ):
             return True
 
+        chat = cmd = None
+        if message is not None:
+            try:
+                chat = utils.get_chat_id(message)
+            except Exception:
+                pass
+
+            if (parsed := getattr(message, "hikka_parsed_command", None)) is not None:
+                cmd = parsed.alias
+            else:
+                try:
+                    cmd = message.raw_text[1:].split()[0].strip()
+                    if usernames:
+                        for username in usernames:
+                            cmd = cmd.replace(f"@{username}", "")
+                except Exception:
+                    cmd = None
+
+        key = (user_id, chat, func, config, cmd, inline_cmd, message is None)
+        if (decision := self._decisions.get(key)) and decision[1] >= time.time():
+            self._decision_hits += 1
+            return decision[0]
+
+        self._decision_misses += 1
+        result, expires = await self._decide(
+            message,
+            func,
+            config,
+            user_id,
+            chat,
+            cmd,
+            inline_cmd,
+        )
+
+        if self.generation == generation:
+            self._decisions[key] = (result, expires)
+            self._decisions_index.setdefault((user_id, chat), set()).add(key)
+            if len(self._decisions) > DECISIONS_LIMIT:
+                oldest = next(iter(self._decisions))
+                del self._decisions[oldest]
+                pair = oldest[:2]
+                if (keys := self._decisions_index.get(pair)) is not None:
+                    keys.discard(oldest)
+                    if not keys:
+                        del self._decisions_index[pair]
+
+        return result
+
+    def forget(self, chat_id: int, user_id: int):
+        """
+        Drop memoized decisions about user in chat, e.g. after user's rights
+        in that chat are changed
+
+        :param chat_id: Chat ID without -100
+        :param user_id: User ID
+        """
+        for key in self._decisions_index.pop((user_id, chat_id), ()):
+            self._decisions.pop(key, None)
+
+    async def _decide(
+        self,
+        message: typing.Optional[Message],
+        func: typing.Union[Command, int],
+        config: int,
+        user_id: int,
+        chat: typing.Optional[int],
+        cmd: typing.Optional[str],
+        inline_cmd: typing.Optional[str],
+    ) -> typing.Tuple[bool, float]:
+        """
+        Computes permission decision for `check`
+
+        :return: Decision and the moment, until which it can be reused
+        """
+
         logger.debug("Checking security match for %s", config)
 
         if config & SUDO or config & SUPPORT:
@@ -447,98 +645,54 @@ class SecurityManager:
         )
 
         if user_id in self._owner:
-            return True
+            return True, math.inf
 
         if user_id in self._db.get(main.__name__, "blacklist_users", []):
-            return False
+            return False, math.inf
 
         if message is None:  # In case of checking inline query security map
-            return self._check_tsec_inline(user_id, inline_cmd) or bool(
-                config & EVERYONE
+            return (
+                self._check_tsec_inline(user_id, inline_cmd) or bool(config & EVERYONE),
+                math.inf,
             )
 
-        try:
-            chat = utils.get_chat_id(message)
-        except Exception:
-            chat = None
-
-        try:
-            cmd = message.raw_text[1:].split()[0].strip()
-            if usernames:
-                for username in usernames:
-                    cmd = cmd.replace(f"@{username}", "")
-        except Exception:
-            cmd = None
-
         if callable(func):
             command = self._client.loader.find_alias(cmd, include_legacy=True) or cmd
+            module = (
+                func.__self__.__class__.__name__ if hasattr(func, "__self__") else None
+            )
+
+            if sgroup_rules := self._sgroup_rules.get(user_id):
+                if ("command", command) in sgroup_rules:
+                    logger.debug("sgroup match for %s", command)
+                    return True, math.inf
 
-            for info in self._sgroups.copy().values():
-                if user_id in info.users:
-                    for permission in info.permissions:
-                        if (
-                            permission["rule_type"] == "command"
-                            and permission["rule"] == command
-                        ):
-                            logger.debug("sgroup match for %s", command)
-                            return True
-
-                        if (
-                            permission["rule_type"] == "module"
-                            and permission["rule"] == func.__self__.__class__.__name__
-                        ):
-                            logger.debug(
-                                "sgroup match for %s", func.__self__.__class__.__name__
-                            )
-                            return True
-
-            for info in self._tsec_user.copy():
-                if info["target"] == user_id:
-                    if info["rule_type"] == "command" and info["rule"] == command:
-                        logger.debug("tsec match for user %s", command)
-                        return True
-
-                    if (
-                        info["rule_type"] == "module"
-                        and info["rule"] == func.__self__.__class__.__name__
-                    ):
-                        logger.debug(
-                            "tsec match for user %s",
-                            func.__self__.__class__.__name__,
-                        )
-                        return True
-
-            if chat:
-                for info in self._tsec_chat.copy():
-                    if info["target"] == chat:
-                        if info["rule_type"] == "command" and info["rule"] == command:
-                            logger.debug("tsec match for %s", command)
-                            return True
-
-                        if (
-                            info["rule_type"] == "module"
-                            and info["rule"] == func.__self__.__class__.__name__
-                        ):
-                            logger.debug(
-                                "tsec match for %s",
-                                func.__self__.__class__.__name__,
-                            )
-                            return True
+                if ("module", module) in sgroup_rules:
+                    logger.debug("sgroup match for %s", module)
+                    return True, math.inf
+
+            if match := self._match_rules(self._user_rules, user_id, command, module):
+                logger.debug("tsec match for user %s", match)
+                return True, math.inf
+
+            if chat and (
+                match := self._match_rules(self._chat_rules, chat, command, module)
+            ):
+                logger.debug("tsec match for %s", match)
+                return True, math.inf
 
         if f_group_member and message.is_group or f_pm and message.is_private:
-            return True
+            return True, math.inf
 
         if message.is_channel:
+            expires = math.inf
             if not message.is_group:
                 chat_id = utils.get_chat_id(message)
-                if (
-                    chat_id in self._cache
-                    and self._cache[chat_id]["exp"] >= time.time()
-                ):
-                    chat = self._cache[chat_id]["chat"]
-                else:
+                if (chat := self._cache.get(chat_id)) is None:
                     chat = await message.get_chat()
-                    self._cache[chat_id] = {"chat": chat, "exp": time.time() + 5 * 60}
+                    self._cache.set(chat_id, chat)
+
+                expires = self._cache.expires(chat_id)
 
                 if (
                     not chat.creator
@@ -546,27 +700,18 @@ class SecurityManager:
                     or not chat.creator
                     and not chat.admin_rights.post_messages
                 ):
-                    return False
+                    return False, expires
 
                 if self._any_admin and f_group_admin_any or f_group_admin:
-                    return True
+                    return True, expires
             elif f_group_admin_any or f_group_owner:
-                chat_id = utils.get_chat_id(message)
-                cache_obj = f"{chat_id}/{user_id}"
-                if (
-                    cache_obj in self._cache
-                    and self._cache[cache_obj]["exp"] >= time.time()
-                ):
-                    participant = self._cache[cache_obj]["user"]
-                else:
-                    participant = await message.client.get_permissions(
-                        message.peer_id,
-                        user_id,
-                    )
-                    self._cache[cache_obj] = {
-                        "user": participant,
-                        "exp": time.time() + 5 * 60,
-                    }
+                participant = await self._client.get_participant_perms(
+                    message.peer_id,
+                    user_id,
+                )
+                expires = self._client.hikka_perms_cache.expires(
+                    (utils.get_chat_id(message), user_id)
+                )
 
                 if (
                     participant.is_creator
@@ -589,44 +734,26 @@ class SecurityManager:
                         and participant.invite_users
                     )
                 ):
-                    return True
-            return False
+                    return True, expires
+            return False, expires
 
         if message.is_group and (f_group_admin_any or f_group_owner):
-            chat_id = utils.get_chat_id(message)
-            cache_obj = f"{chat_id}/{user_id}"
-
-            if (
-                cache_obj in self._cache
-                and self._cache[cache_obj]["exp"] >= time.time()
-            ):
-                participant = self._cache[cache_obj]["user"]
-            else:
-                full_chat = await message.client(GetFullChatRequest(message.chat_id))
-                participants = full_chat.full_chat.participants.participants
-                participant = next(
-                    (
-                        possible_participant
-                        for possible_participant in participants
-                        if possible_participant.user_id == message.sender_id
-                    ),
-                    None,
-                )
-                self._cache[cache_obj] = {
-                    "user": participant,
-                    "exp": time.time() + 5 * 60,
-                }
+            participant = await self._client.get_participant_perms(
+                message.peer_id,
+                user_id,
+            )
+            expires = self._client.hikka_perms_cache.expires(
+                (utils.get_chat_id(message), user_id)
+            )
 
             if not participant:
-                return
+                return False, expires
 
-            if (
-                isinstance(participant, ChatParticipantCreator)
-                or isinstance(participant, ChatParticipantAdmin)
-                and f_group_admin_any
-            ):
-                return True
+            if participant.is_creator or participant.is_admin and f_group_admin_any:
+                return True, expires
+
+            return False, expires
 
-        return False
+        return False, math.inf
 
     _check = check  # Legacy
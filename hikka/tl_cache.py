@@ -4,29 +4,53 @@
 # You can redistribute it and/or modify it under the terms of the GNU AGPLv3
 # 🔑 https://www.gnu.org/licenses/agpl-3.0.html
 
+import asyncio
+import contextlib
 import copy
 import inspect
+import itertools
 import logging
 import time
 import typing
+from collections import OrderedDict
+from collections.abc import MutableMapping
 
 from hikkatl import TelegramClient
+from hikkatl.errors import BadRequestError
 from hikkatl.errors.rpcerrorlist import TopicDeletedError
-from hikkatl.hints import EntityLike
+from hikkatl.hints import Entity, EntityLike
 from hikkatl.network import MTProtoSender
-from hikkatl.tl.functions.channels import GetFullChannelRequest
-from hikkatl.tl.functions.users import GetFullUserRequest
+from hikkatl.tl.custom.participantpermissions import ParticipantPermissions
+from hikkatl.tl.functions.channels import GetChannelsRequest, GetFullChannelRequest
+from hikkatl.tl.functions.messages import GetChatsRequest, GetFullChatRequest
+from hikkatl.tl.functions.users import GetFullUserRequest, GetUsersRequest
 from hikkatl.tl.tlobject import TLRequest
 from hikkatl.tl.types import (
     ChannelFull,
+    InputChannel,
+    InputPeerChannel,
+    InputPeerChat,
+    InputPeerUser,
+    InputUser,
     Message,
+    PeerChannel,
+    PeerChat,
+    UpdateChannel,
+    UpdateChannelParticipant,
+    UpdateChatParticipantAdd,
+    UpdateChatParticipantAdmin,
+    UpdateChatParticipantDelete,
     Updates,
     UpdatesCombined,
     UpdateShort,
+    UpdateUser,
+    UpdateUserName,
+    UserEmpty,
     UserFull,
 )
-from hikkatl.utils import is_list_like
+from hikkatl.utils import get_peer_id, is_list_like, resolve_id
 
+from ._context import get_context
 from .types import (
     CacheRecordEntity,
     CacheRecordFullChannel,
@@ -37,6 +61,16 @@ from .types import (
 
 logger = logging.getLogger(__name__)
 
+# Entities are invalidated by updates, so they can be kept longer than other records
+ENTITY_TTL = 15 * 60
+# For how long full info records are kept, so they can be served stale
+FULL_HARD_TTL = 60 * 60
+
+# Maximum amount of peers in single users.getUsers / channels.getChannels /
+# messages.getChats request
+USERS_CHUNK = 200
+CHATS_CHUNK = 100
+
 
 def hashable(value: typing.Any) -> bool:
     """
@@ -53,28 +87,307 @@ def hashable(value: typing.Any) -> bool:
     return True
 
 
+def shallow_copy(obj: typing.Any) -> typing.Any:
+    """
+    Copy object for caller of cache. Attributes are shared, except for lists,
+    which are copied, so reassigning or extending them doesn't affect cached
+    object. Much cheaper than deepcopy of TL objects
+
+    :param obj: Object to copy
+    :return: Copy of object
+    """
+    try:
+        attrs = obj.__dict__
+        result = object.__new__(type(obj))
+    except (AttributeError, TypeError):
+        return copy.copy(obj)
+
+    result.__dict__.update(
+        {
+            key: value.copy() if type(value) is list else value
+            for key, value in attrs.items()
+        }
+    )
+    return result
+
+
+class _CacheRecord:
+    __slots__ = ("value", "expires", "aliases", "weight")
+
+    def __init__(self, value: typing.Any, expires: float, weight: int):
+        self.value = value
+        self.expires = expires
+        self.aliases: typing.Set[typing.Hashable] = set()
+        self.weight = weight
+
+
+class LRUCache(MutableMapping):
+    """
+    Size-bounded mapping, which evicts least recently used and expired records.
+    Records can be reached by alias keys, which are removed together with
+    the record. Supports dict interface, so it can be used in place of plain
+    dict caches. Iteration goes over primary keys of alive records
+    """
+
+    _missing = object()
+
+    def __init__(
+        self,
+        max_size: int = 4096,
+        ttl: float = 5 * 60,
+        max_bytes: typing.Optional[int] = None,
+        weigh: typing.Optional[typing.Callable[[typing.Any], int]] = None,
+    ):
+        """
+        :param max_size: Maximum amount of records
+        :param ttl: Default time to live of records
+        :param max_bytes: Maximum total weight of records, requires `weigh`
+        :param weigh: Function, which estimates size of value in bytes
+        """
+        if max_bytes is not None and weigh is None:
+            raise ValueError("max_bytes requires weigh function")
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._weigh = weigh
+        self._records: typing.OrderedDict[typing.Hashable, _CacheRecord] = OrderedDict()
+        self._aliases: typing.Dict[typing.Hashable, typing.Hashable] = {}
+        self._bytes = 0
+        self._sets = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __contains__(self, key: typing.Hashable) -> bool:
+        return self.expires(key) >= time.time()
+
+    def __getitem__(self, key: typing.Hashable) -> typing.Any:
+        if (value := self.get(key, self._missing)) is self._missing:
+            raise KeyError(key)
+
+        return value
+
+    def __setitem__(self, key: typing.Hashable, value: typing.Any):
+        self.set(key, value)
+
+    def __delitem__(self, key: typing.Hashable):
+        if self.pop(key, self._missing) is self._missing:
+            raise KeyError(key)
+
+    def __iter__(self) -> typing.Iterator[typing.Hashable]:
+        return iter(self.keys())
+
+    def _resolve(self, key: typing.Hashable) -> typing.Hashable:
+        return self._aliases.get(key, key)
+
+    def _drop(self, primary: typing.Hashable) -> _CacheRecord:
+        record = self._records.pop(primary)
+        for alias in record.aliases:
+            del self._aliases[alias]
+
+        self._bytes -= record.weight
+        return record
+
+    def _evict(self):
+        while len(self._records) > self.max_size or (
+            self.max_bytes is not None
+            and self._bytes > self.max_bytes
+            and len(self._records) > 1
+        ):
+            self._drop(next(iter(self._records)))
+            self.evictions += 1
+
+    def purge(self) -> int:
+        """
+        Remove all expired records
+        :return: Amount of removed records
+        """
+        now = time.time()
+        expired = [
+            primary for primary, record in self._records.items() if record.expires < now
+        ]
+        for primary in expired:
+            self._drop(primary)
+
+        return len(expired)
+
+    def get(self, key: typing.Hashable, default: typing.Any = None) -> typing.Any:
+        """
+        Get record and mark it as recently used
+        :param key: Record key or alias
+        :param default: Value to return if record is missing or expired
+        :return: Record value
+        """
+        primary = self._resolve(key)
+        if (record := self._records.get(primary)) is None:
+            self.misses += 1
+            return default
+
+        if record.expires < time.time():
+            self._drop(primary)
+            self.misses += 1
+            return default
+
+        self._records.move_to_end(primary)
+        self.hits += 1
+        return record.value
+
+    def set(
+        self,
+        key: typing.Hashable,
+        value: typing.Any,
+        ttl: typing.Optional[float] = None,
+        aliases: typing.Iterable[typing.Hashable] = (),
+    ):
+        """
+        Save record, evicting the least recently used ones if cache is full
+        :param key: Primary record key
+        :param value: Record value
+        :param ttl: Time to live of record, defaults to cache one
+        :param aliases: Additional keys, which point to the same record
+        """
+        for stale in {key, *aliases}:
+            if (owner := self._aliases.pop(stale, None)) is not None:
+                self._records[owner].aliases.discard(stale)
+
+            if stale in self._records:
+                self._drop(stale)
+
+        record = _CacheRecord(
+            value,
+            time.time() + (self.ttl if ttl is None else ttl),
+            self._weigh(value) if self._weigh else 0,
+        )
+        self._records[key] = record
+        self._bytes += record.weight
+        for alias in aliases:
+            if alias != key:
+                record.aliases.add(alias)
+                self._aliases[alias] = key
+
+        self._sets += 1
+        if self._sets >= max(64, self.max_size // 4):
+            self._sets = 0
+            self.purge()
+
+        self._evict()
+
+    def pop(self, key: typing.Hashable, default: typing.Any = None) -> typing.Any:
+        """
+        Remove record together with its aliases
+        :param key: Record key or alias
+        :param default: Value to return if record is missing
+        :return: Removed record value
+        """
+        primary = self._resolve(key)
+        if primary not in self._records:
+            return default
+
+        return self._drop(primary).value
+
+    def expires(self, key: typing.Hashable) -> float:
+        """
+        Get expiration moment of record
+        :param key: Record key or alias
+        :return: Expiration timestamp or 0 if record is missing
+        """
+        record = self._records.get(self._resolve(key))
+        return 0 if record is None else record.expires
+
+    def records(
+        self,
+    ) -> typing.List[
+        typing.Tuple[typing.Hashable, typing.Any, float, typing.Set[typing.Hashable]]
+    ]:
+        """
+        Get alive records without marking them as used
+        :return: List of (key, value, expires, aliases), least recently used first
+        """
+        now = time.time()
+        return [
+            (key, record.value, record.expires, set(record.aliases))
+            for key, record in self._records.items()
+            if record.expires > now
+        ]
+
+    def keys(self) -> typing.List[typing.Hashable]:
+        """
+        Get primary keys of alive records without marking them as used
+        :return: List of keys, least recently used first
+        """
+        self.purge()
+        return list(self._records)
+
+    def values(self) -> typing.List[typing.Any]:
+        """
+        Get values of alive records without marking them as used
+        :return: List of values, least recently used first
+        """
+        self.purge()
+        return [record.value for record in self._records.values()]
+
+    def items(self) -> typing.List[typing.Tuple[typing.Hashable, typing.Any]]:
+        """
+        Get alive records without marking them as used
+        :return: List of (key, value), least recently used first
+        """
+        self.purge()
+        return [(key, record.value) for key, record in self._records.items()]
+
+    def clear(self):
+        """Remove all records"""
+        self._records.clear()
+        self._aliases.clear()
+        self._bytes = 0
+
+    def stats(self) -> dict:
+        """
+        Get cache statistics
+        :return: Hits, misses, evictions, size and weight of cache
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._records),
+            "aliases": len(self._aliases),
+            "bytes": self._bytes,
+        }
+
+
 class CustomTelegramClient(TelegramClient):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-        self._hikka_entity_cache: typing.Dict[
-            typing.Union[str, int],
-            CacheRecordEntity,
-        ] = {}
-
-        self._hikka_perms_cache: typing.Dict[
-            typing.Union[str, int],
-            CacheRecordPerms,
+        self._hikka_entity_cache = LRUCache(max_size=8192)
+        self._hikka_perms_cache = LRUCache(max_size=8192)
+
+        self._hikka_fullchannel_cache = LRUCache(max_size=1024, ttl=FULL_HARD_TTL)
+        self._hikka_fulluser_cache = LRUCache(max_size=2048, ttl=FULL_HARD_TTL)
+        self._hikka_stale_stats: typing.Dict[str, typing.Dict[str, float]] = {
+            cache: {
+                "stale_hits": 0,
+                "refreshes": 0,
+                "refresh_errors": 0,
+                "last_stale_age": 0.0,
+                "max_stale_age": 0.0,
+            }
+            for cache in ("fullchannel", "fulluser")
+        }
+
+        self._hikka_edit_author_cache: typing.Dict[
+            typing.Tuple[int, int, typing.Any],
+            typing.Tuple[typing.Optional[int], float],
         ] = {}
 
-        self._hikka_fullchannel_cache: typing.Dict[
-            typing.Union[str, int],
-            CacheRecordFullChannel,
-        ] = {}
-
-        self._hikka_fulluser_cache: typing.Dict[
-            typing.Union[str, int],
-            CacheRecordFullUser,
+        # In-flight requests by (cache, key), so concurrent misses share one RPC
+        self._hikka_requests: typing.Dict[
+            typing.Tuple[str, typing.Hashable],
+            asyncio.Future,
         ] = {}
 
         self._forbidden_constructors: typing.List[int] = []
@@ -101,25 +414,142 @@ class CustomTelegramClient(TelegramClient):
         self._raw_updates_processor = value
 
     @property
-    def hikka_entity_cache(self) -> typing.Dict[int, CacheRecordEntity]:
+    def hikka_entity_cache(self) -> LRUCache:
         return self._hikka_entity_cache
 
     @property
-    def hikka_perms_cache(self) -> typing.Dict[int, CacheRecordPerms]:
+    def hikka_perms_cache(self) -> LRUCache:
         return self._hikka_perms_cache
 
     @property
-    def hikka_fullchannel_cache(self) -> typing.Dict[int, CacheRecordFullChannel]:
+    def hikka_fullchannel_cache(self) -> LRUCache:
         return self._hikka_fullchannel_cache
 
     @property
-    def hikka_fulluser_cache(self) -> typing.Dict[int, CacheRecordFullUser]:
+    def hikka_fulluser_cache(self) -> LRUCache:
         return self._hikka_fulluser_cache
 
+    def hikka_cache_stats(self) -> typing.Dict[str, dict]:
+        """
+        Gets statistics of client caches
+
+        :return: Hits, misses, evictions and size of each cache. Full info caches
+            also have stale hits, background refreshes and age of served stale records
+        """
+        return {
+            "entity": self._hikka_entity_cache.stats(),
+            "perms": self._hikka_perms_cache.stats(),
+            "fullchannel": {
+                **self._hikka_fullchannel_cache.stats(),
+                **self._hikka_stale_stats["fullchannel"],
+            },
+            "fulluser": {
+                **self._hikka_fulluser_cache.stats(),
+                **self._hikka_stale_stats["fulluser"],
+            },
+        }
+
     @property
     def forbidden_constructors(self) -> typing.List[str]:
         return self._forbidden_constructors
 
+    def _start_request(
+        self,
+        cache: str,
+        key: typing.Hashable,
+        factory: typing.Callable[[], typing.Awaitable[typing.Any]],
+    ) -> asyncio.Future:
+        """
+        Starts request, unless the one for the same key is already in flight
+        :param cache: Name of the cache request belongs to
+        :param key: Key of the request within cache
+        :param factory: Coroutine function, which makes the request
+        :return: Future of the request
+        """
+        request_key = (cache, key)
+        if not (future := self._hikka_requests.get(request_key)):
+            future = asyncio.ensure_future(factory())
+            self._hikka_requests[request_key] = future
+
+            def _done(done: asyncio.Future):
+                if self._hikka_requests.get(request_key) is done:
+                    del self._hikka_requests[request_key]
+
+                # Mark exception as retrieved, even if nobody awaits it anymore
+                if not done.cancelled():
+                    done.exception()
+
+            future.add_done_callback(_done)
+        else:
+            logger.debug("Joining in-flight %s request of %s", cache, key)
+
+        return future
+
+    async def _single_flight(
+        self,
+        cache: str,
+        key: typing.Hashable,
+        factory: typing.Callable[[], typing.Awaitable[typing.Any]],
+    ) -> typing.Any:
+        """
+        Awaits request, joining the one already in flight for the same key
+        Result and exception are delivered to every waiter, but not stored
+        :param cache: Name of the cache request belongs to
+        :param key: Key of the request within cache
+        :param factory: Coroutine function, which makes the request
+        :return: Result of the request
+        """
+        return await asyncio.shield(self._start_request(cache, key, factory))
+
+    def _get_full_record(
+        self,
+        cache: str,
+        hashable_entity: typing.Hashable,
+        exp: int,
+        stale_ok: bool,
+        hard_exp: int,
+        factory: typing.Callable[[], typing.Awaitable[typing.Any]],
+    ) -> typing.Optional[typing.Union[CacheRecordFullChannel, CacheRecordFullUser]]:
+        """
+        Gets full info record from cache. Stale record is returned only in
+        `stale_ok` mode, and the refresh of it is started in background
+        :param cache: Name of the cache
+        :param hashable_entity: Key of the record
+        :param exp: Maximum age of fresh record
+        :param stale_ok: Whether stale record can be returned
+        :param hard_exp: Maximum age of stale record
+        :param factory: Coroutine function, which refreshes the record
+        :return: Record or None if caller must wait for the request
+        """
+        if not (record := getattr(self, f"_hikka_{cache}_cache").get(hashable_entity)):
+            return None
+
+        age = time.time() - record.ts
+        if not record.expired and age < exp:
+            return record
+
+        if not stale_ok or age >= hard_exp:
+            return None
+
+        stats = self._hikka_stale_stats[cache]
+        stats["stale_hits"] += 1
+        stats["last_stale_age"] = age
+        stats["max_stale_age"] = max(stats["max_stale_age"], age)
+
+        if (cache, hashable_entity) not in self._hikka_requests:
+            stats["refreshes"] += 1
+            logger.debug("Serving stale %s of %s, refreshing", cache, hashable_entity)
+
+            def _count_error(future: asyncio.Future):
+                if not future.cancelled() and future.exception():
+                    stats["refresh_errors"] += 1
+
+            self._start_request(cache, hashable_entity, factory).add_done_callback(
+                _count_error
+            )
+
+        return record
+
     async def force_get_entity(self, *args, **kwargs):
         """Forcefully makes a request to Telegram to get the entity."""
 
@@ -128,8 +558,9 @@ class CustomTelegramClient(TelegramClient):
     async def get_entity(
         self,
         entity: EntityLike,
-        exp: int = 5 * 60,
+        exp: int = ENTITY_TTL,
         force: bool = False,
+        readonly: bool = False,
     ):
         """
         Gets the entity and cache it
@@ -137,6 +568,7 @@ class CustomTelegramClient(TelegramClient):
         :param entity: Entity to fetch
         :param exp: Expiration time of the cache record and maximum time of already cached record
         :param force: Whether to force refresh the cache (make API request)
+        :param readonly: Return cached object itself instead of a copy. It must not be modified
         :return: :obj:`Entity`
         """
 
@@ -144,6 +576,196 @@ class CustomTelegramClient(TelegramClient):
         # parsed via inspect.stack()
         _hikka_client_id_logging_tag = copy.copy(self.tg_id)  # noqa: F841
 
+        if (hashable_entity := self._get_hashable_entity(entity)) is None:
+            logger.debug(
+                "Can't parse hashable from entity %s, using legacy resolve",
+                entity,
+            )
+            return await TelegramClient.get_entity(self, entity)
+
+        if (
+            not force
+            and hashable_entity
+            and (record := self._hikka_entity_cache.get(hashable_entity))
+            and (not exp or record.ts + exp > time.time())
+        ):
+            logger.debug(
+                "Using cached entity %s (%s)",
+                entity,
+                type(record.entity).__name__,
+            )
+            return record.entity if readonly else shallow_copy(record.entity)
+
+        if hashable_entity:
+            resolved_entity = await self._single_flight(
+                "entity",
+                hashable_entity,
+                lambda: self._fetch_entity(entity, hashable_entity, exp),
+            )
+        else:
+            resolved_entity = await TelegramClient.get_entity(self, entity)
+
+        return resolved_entity if readonly else shallow_copy(resolved_entity)
+
+    async def _fetch_entity(
+        self,
+        entity: EntityLike,
+        hashable_entity: typing.Hashable,
+        exp: int,
+    ):
+        resolved_entity = await TelegramClient.get_entity(self, entity)
+
+        if resolved_entity:
+            self._hikka_entity_cache.set(
+                hashable_entity,
+                CacheRecordEntity(hashable_entity, resolved_entity, exp),
+                max(exp, self._hikka_entity_cache.ttl),
+                self._get_entity_aliases(resolved_entity),
+            )
+            logger.debug("Saved hashable_entity %s to cache", hashable_entity)
+
+        return resolved_entity
+
+    async def get_entities(
+        self,
+        entities: typing.Iterable[EntityLike],
+        exp: int = ENTITY_TTL,
+        force: bool = False,
+        readonly: bool = False,
+    ) -> typing.List[typing.Optional[Entity]]:
+        """
+        Gets multiple entities and cache them. Cached ones are served from cache,
+        the rest is fetched with bulk requests instead of one request per entity
+
+        :param entities: Entities to fetch
+        :param exp: Expiration time of the cache records and maximum time of already cached records
+        :param force: Whether to force refresh the cache (make API requests)
+        :param readonly: Return cached objects themselves instead of copies. They must not be modified
+        :return: List of :obj:`Entity` in the same order as input. Entities, which
+            could not be resolved, are replaced with None
+        """
+        entities = list(entities)
+        results: typing.List[typing.Optional[Entity]] = [None] * len(entities)
+
+        # hashable entity -> indexes of entities in input
+        misses: typing.Dict[typing.Hashable, typing.List[int]] = {}
+        singles: typing.List[int] = []
+        for i, entity in enumerate(entities):
+            if not (hashable_entity := self._get_hashable_entity(entity)):
+                singles.append(i)
+                continue
+
+            if (
+                not force
+                and (record := self._hikka_entity_cache.get(hashable_entity))
+                and (not exp or record.ts + exp > time.time())
+            ):
+                results[i] = record.entity
+                continue
+
+            misses.setdefault(hashable_entity, []).append(i)
+
+        joined: typing.Dict[typing.Hashable, asyncio.Future] = {}
+        # peer id -> hashable entities, which resolve to it
+        keys: typing.Dict[int, typing.List[typing.Hashable]] = {}
+        users, chats, channels = [], [], []
+        for hashable_entity, indexes in misses.items():
+            if future := self._hikka_requests.get(("entity", hashable_entity)):
+                joined[hashable_entity] = future
+                continue
+
+            try:
+                peer = await self.get_input_entity(entities[indexes[0]])
+            except Exception:
+                logger.debug("Can't resolve %s", hashable_entity, exc_info=True)
+                continue
+
+            if isinstance(peer, InputPeerUser):
+                bucket, input_peer = users, InputUser(peer.user_id, peer.access_hash)
+            elif isinstance(peer, InputPeerChannel):
+                bucket, input_peer = (
+                    channels,
+                    InputChannel(peer.channel_id, peer.access_hash),
+                )
+            elif isinstance(peer, InputPeerChat):
+                bucket, input_peer = chats, peer.chat_id
+            else:
+                singles.extend(indexes)
+                continue
+
+            peer_id = get_peer_id(peer)
+            if peer_id not in keys:
+                bucket.append((peer_id, input_peer))
+
+            keys.setdefault(peer_id, []).append(hashable_entity)
+
+        fetched = []
+        for bucket, chunk_size, request in (
+            (users, USERS_CHUNK, GetUsersRequest),
+            (chats, CHATS_CHUNK, GetChatsRequest),
+            (channels, CHATS_CHUNK, GetChannelsRequest),
+        ):
+            for offset in range(0, len(bucket), chunk_size):
+                chunk = bucket[offset : offset + chunk_size]
+                try:
+                    response = await self(request([peer for _, peer in chunk]))
+                except (BadRequestError, ValueError):
+                    # Single invalid peer fails the whole chunk, so fall back
+                    # to fetching its entities one by one
+                    logger.debug("Bulk %s failed", request.__name__, exc_info=True)
+                    singles.extend(
+                        i
+                        for peer_id, _ in chunk
+                        for hashable_entity in keys[peer_id]
+                        for i in misses[hashable_entity]
+                    )
+                    continue
+
+                fetched += getattr(response, "chats", response)
+
+        for resolved_entity in fetched:
+            if isinstance(resolved_entity, UserEmpty) or not (
+                hashables := keys.get(get_peer_id(resolved_entity))
+            ):
+                continue
+
+            self._hikka_entity_cache.set(
+                hashables[0],
+                CacheRecordEntity(hashables[0], resolved_entity, exp),
+                max(exp, self._hikka_entity_cache.ttl),
+                hashables[1:] + self._get_entity_aliases(resolved_entity),
+            )
+            for hashable_entity in hashables:
+                for i in misses[hashable_entity]:
+                    results[i] = resolved_entity
+
+        logger.debug("Fetched %s of %s entities in bulk", len(fetched), len(entities))
+
+        for hashable_entity, future in joined.items():
+            with contextlib.suppress(Exception):
+                resolved_entity = await asyncio.shield(future)
+                for i in misses[hashable_entity]:
+                    results[i] = resolved_entity
+
+        for i in singles:
+            try:
+                results[i] = await self.get_entity(entities[i], exp, force, True)
+            except Exception:
+                logger.debug("Can't resolve %s", entities[i], exc_info=True)
+
+        return (
+            results
+            if readonly
+            else [entity and shallow_copy(entity) for entity in results]
+        )
+
+    @staticmethod
+    def _get_hashable_entity(entity: EntityLike) -> typing.Optional[typing.Hashable]:
+        """
+        Gets key of entity in cache
+        :param entity: Entity to get key of
+        :return: Key or None if entity can't be cached
+        """
         if not hashable(entity):
             try:
                 hashable_entity = next(
@@ -152,53 +774,80 @@ class CustomTelegramClient(TelegramClient):
                     if getattr(entity, attr, None)
                 )
             except StopIteration:
-                logger.debug(
-                    "Can't parse hashable from entity %s, using legacy resolve",
-                    entity,
-                )
-                return await TelegramClient.get_entity(self, entity)
+                return None
         else:
             hashable_entity = entity
 
         if str(hashable_entity).isdigit() and int(hashable_entity) < 0:
             hashable_entity = int(str(hashable_entity)[4:])
 
-        if (
-            not force
-            and hashable_entity
-            and hashable_entity in self._hikka_entity_cache
-            and (
-                not exp
-                or self._hikka_entity_cache[hashable_entity].ts + exp > time.time()
-            )
-        ):
-            logger.debug(
-                "Using cached entity %s (%s)",
-                entity,
-                type(self._hikka_entity_cache[hashable_entity].entity).__name__,
-            )
-            return copy.deepcopy(self._hikka_entity_cache[hashable_entity].entity)
+        return hashable_entity
 
-        resolved_entity = await TelegramClient.get_entity(self, entity)
+    @staticmethod
+    def _get_entity_aliases(entity: EntityLike) -> typing.List[typing.Union[str, int]]:
+        """
+        Gets keys, by which entity can be found in cache, besides hashable one
+        """
+        aliases = []
+        if getattr(entity, "id", None):
+            aliases.append(entity.id)
+            with contextlib.suppress(TypeError):
+                if (peer_id := get_peer_id(entity)) != entity.id:
+                    aliases.append(peer_id)
 
-        if resolved_entity:
-            cache_record = CacheRecordEntity(hashable_entity, resolved_entity, exp)
-            self._hikka_entity_cache[hashable_entity] = cache_record
-            logger.debug("Saved hashable_entity %s to cache", hashable_entity)
+        if getattr(entity, "username", None):
+            aliases += [f"@{entity.username}", entity.username]
 
-            if getattr(resolved_entity, "id", None):
-                logger.debug("Saved resolved_entity id %s to cache", resolved_entity.id)
-                self._hikka_entity_cache[resolved_entity.id] = cache_record
+        return aliases
 
-            if getattr(resolved_entity, "username", None):
-                logger.debug(
-                    "Saved resolved_entity username @%s to cache",
-                    resolved_entity.username,
-                )
-                self._hikka_entity_cache[f"@{resolved_entity.username}"] = cache_record
-                self._hikka_entity_cache[resolved_entity.username] = cache_record
+    async def _fetch_edit_author(
+        self,
+        key: typing.Tuple[int, int, typing.Any],
+    ) -> typing.Optional[int]:
+        channel_id, message_id, _ = key
+        user_id = None
+        async for event in self.iter_admin_log(channel_id, limit=10, edit=True):
+            if event.action.prev_message.id == message_id:
+                user_id = event.user_id
+                break
+
+        now = time.time()
+        for cached_key, (_, ts) in list(self._hikka_edit_author_cache.items()):
+            if ts + 60 < now:
+                del self._hikka_edit_author_cache[cached_key]
+
+        self._hikka_edit_author_cache[key] = (user_id, now)
+        return user_id
+
+    async def get_edit_author(
+        self,
+        channel_id: int,
+        message_id: int,
+        edit_date: typing.Any = None,
+        exp: int = 10,
+    ) -> typing.Optional[int]:
+        """
+        Gets the admin, who made the latest edit of channel post, and cache it.
+        Concurrent lookups of the same post share a single admin log request
+
+        :param channel_id: Channel id of the post
+        :param message_id: Id of the post
+        :param edit_date: Edit date of the post, so the next edit is not served from cache
+        :param exp: Expiration time of the cache record
+        :return: User id of the editor or None if edit was not found in admin log
+        """
+        key = (channel_id, message_id, edit_date)
 
-        return copy.deepcopy(resolved_entity)
+        record = self._hikka_edit_author_cache.get(key)
+        if record and record[1] + exp > time.time():
+            logger.debug("Using cached edit author of %s/%s", channel_id, message_id)
+            return record[0]
+
+        return await self._single_flight(
+            "edit_author",
+            key,
+            lambda: self._fetch_edit_author(key),
+        )
 
     async def get_perms_cached(
         self,
@@ -206,6 +855,7 @@ class CustomTelegramClient(TelegramClient):
         user: typing.Optional[EntityLike] = None,
         exp: int = 5 * 60,
         force: bool = False,
+        readonly: bool = False,
     ):
         """
         Gets the permissions of the user in the entity and cache it
@@ -214,6 +864,7 @@ class CustomTelegramClient(TelegramClient):
         :param user: User to fetch
         :param exp: Expiration time of the cache record and maximum time of already cached record
         :param force: Whether to force refresh the cache (make API request)
+        :param readonly: Return cached object itself instead of a copy. It must not be modified
         :return: :obj:`ChatPermissions`
         """
 
@@ -221,8 +872,8 @@ class CustomTelegramClient(TelegramClient):
         # parsed via inspect.stack()
         _hikka_client_id_logging_tag = copy.copy(self.tg_id)  # noqa: F841
 
-        entity = await self.get_entity(entity)
-        user = await self.get_entity(user) if user else None
+        entity = await self.get_entity(entity, readonly=True)
+        user = await self.get_entity(user, readonly=True) if user else None
 
         if not hashable(entity) or not hashable(user):
             try:
@@ -264,64 +915,117 @@ class CustomTelegramClient(TelegramClient):
             not force
             and hashable_entity
             and hashable_user
-            and hashable_user in self._hikka_perms_cache.get(hashable_entity, {})
             and (
-                not exp
-                or self._hikka_perms_cache[hashable_entity][hashable_user].ts + exp
-                > time.time()
+                record := self._hikka_perms_cache.get((hashable_entity, hashable_user))
             )
+            and (not exp or record.ts + exp > time.time())
         ):
             logger.debug("Using cached perms %s (%s)", hashable_entity, hashable_user)
-            return copy.deepcopy(
-                self._hikka_perms_cache[hashable_entity][hashable_user].perms
-            )
+            return record.perms if readonly else shallow_copy(record.perms)
 
         resolved_perms = await self.get_permissions(entity, user)
 
         if resolved_perms:
-            cache_record = CacheRecordPerms(
-                hashable_entity,
-                hashable_user,
-                resolved_perms,
-                exp,
+            user_aliases = self._get_entity_aliases(user)
+            self._hikka_perms_cache.set(
+                (hashable_entity, hashable_user),
+                CacheRecordPerms(hashable_entity, hashable_user, resolved_perms, exp),
+                max(exp, self._hikka_perms_cache.ttl),
+                [
+                    (entity_alias, user_alias)
+                    for entity_alias in self._get_entity_aliases(entity)
+                    for user_alias in user_aliases
+                ],
             )
-            self._hikka_perms_cache.setdefault(hashable_entity, {})[
-                hashable_user
-            ] = cache_record
             logger.debug("Saved hashable_entity %s perms to cache", hashable_entity)
 
-            def save_user(key: typing.Union[str, int]):
-                nonlocal self, cache_record, user, hashable_user
-                if getattr(user, "id", None):
-                    self._hikka_perms_cache.setdefault(key, {})[user.id] = cache_record
+        return resolved_perms if readonly else shallow_copy(resolved_perms)
 
-                if getattr(user, "username", None):
-                    self._hikka_perms_cache.setdefault(key, {})[
-                        f"@{user.username}"
-                    ] = cache_record
-                    self._hikka_perms_cache.setdefault(key, {})[
-                        user.username
-                    ] = cache_record
+    async def _fetch_participant_perms(
+        self,
+        chat: EntityLike,
+        chat_id: int,
+        user_id: typing.Optional[int],
+        exp: int,
+    ):
+        if user_id is not None:
+            perms = await self.get_permissions(chat, user_id)
+            self._hikka_perms_cache.set(
+                (chat_id, user_id),
+                CacheRecordPerms(chat_id, user_id, perms, exp),
+                exp,
+            )
+            return
 
-            if getattr(entity, "id", None):
-                logger.debug("Saved resolved_entity id %s perms to cache", entity.id)
-                save_user(entity.id)
+        full_chat = await self(GetFullChatRequest(chat_id))
+        participants = getattr(full_chat.full_chat.participants, "participants", None)
+        for participant in participants or []:
+            self._hikka_perms_cache.set(
+                (chat_id, participant.user_id),
+                CacheRecordPerms(
+                    chat_id,
+                    participant.user_id,
+                    ParticipantPermissions(participant, True),
+                    exp,
+                ),
+                exp,
+            )
 
-            if getattr(entity, "username", None):
-                logger.debug(
-                    "Saved resolved_entity username @%s perms to cache",
-                    entity.username,
-                )
-                save_user(f"@{entity.username}")
-                save_user(entity.username)
+        logger.debug(
+            "Saved perms of %s participants of chat %s to cache",
+            len(participants or []),
+            chat_id,
+        )
 
-        return copy.deepcopy(resolved_perms)
+    async def get_participant_perms(
+        self,
+        chat: EntityLike,
+        user_id: int,
+        exp: int = 5 * 60,
+    ) -> typing.Optional[ParticipantPermissions]:
+        """
+        Gets the permissions of chat participant using shared perms cache.
+        In basic groups a single GetFullChatRequest saves permissions of every
+        participant. Concurrent lookups share a single request
+
+        :param chat: Peer of the chat
+        :param user_id: User id of the participant
+        :param exp: Expiration time of the cache records
+        :return: :obj:`ParticipantPermissions` or None if user is not a participant
+            of basic group
+        """
+        chat_id, peer_type = resolve_id(get_peer_id(chat))
+        basic = peer_type is PeerChat
+        key = (chat_id, user_id)
+
+        if (record := self._hikka_perms_cache.get(key)) is not None:
+            return record.perms if record else None
+
+        await self._single_flight(
+            "perms",
+            chat_id if basic else key,
+            lambda: self._fetch_participant_perms(
+                chat,
+                chat_id,
+                None if basic else user_id,
+                exp,
+            ),
+        )
+
+        if (record := self._hikka_perms_cache.get(key)) is None:
+            # User is not a participant of basic group
+            self._hikka_perms_cache.set(key, False, exp)
+            return None
+
+        return record.perms if record else None
 
     async def get_fullchannel(
         self,
         entity: EntityLike,
         exp: int = 300,
         force: bool = False,
+        stale_ok: bool = False,
+        hard_exp: int = FULL_HARD_TTL,
     ) -> ChannelFull:
         """
         Gets the FullChannelRequest and cache it
@@ -329,6 +1033,8 @@ class CustomTelegramClient(TelegramClient):
         :param entity: Channel to fetch ChannelFull of
         :param exp: Expiration time of the cache record and maximum time of already cached record
         :param force: Whether to force refresh the cache (make API request)
+        :param stale_ok: Return expired record immediately, refreshing it in background
+        :param hard_exp: Maximum time of already cached record in `stale_ok` mode
         :return: :obj:`ChannelFull`
         """
         if not hashable(entity):
@@ -353,19 +1059,34 @@ class CustomTelegramClient(TelegramClient):
         if str(hashable_entity).isdigit() and int(hashable_entity) < 0:
             hashable_entity = int(str(hashable_entity)[4:])
 
-        if (
-            not force
-            and self._hikka_fullchannel_cache.get(hashable_entity)
-            and not self._hikka_fullchannel_cache[hashable_entity].expired
-            and self._hikka_fullchannel_cache[hashable_entity].ts + exp > time.time()
+        def factory():
+            return self._fetch_fullchannel(entity, hashable_entity, exp)
+
+        if not force and (
+            record := self._get_full_record(
+                "fullchannel",
+                hashable_entity,
+                exp,
+                stale_ok,
+                hard_exp,
+                factory,
+            )
         ):
-            return self._hikka_fullchannel_cache[hashable_entity].full_channel
+            return record.full_channel
+
+        return await self._single_flight("fullchannel", hashable_entity, factory)
 
+    async def _fetch_fullchannel(
+        self,
+        entity: EntityLike,
+        hashable_entity: typing.Hashable,
+        exp: int,
+    ) -> ChannelFull:
         result = await self(GetFullChannelRequest(channel=entity))
-        self._hikka_fullchannel_cache[hashable_entity] = CacheRecordFullChannel(
+        self._hikka_fullchannel_cache.set(
             hashable_entity,
-            result,
-            exp,
+            CacheRecordFullChannel(hashable_entity, result, exp),
+            max(exp, self._hikka_fullchannel_cache.ttl),
         )
         return result
 
@@ -374,6 +1095,8 @@ class CustomTelegramClient(TelegramClient):
         entity: EntityLike,
         exp: int = 300,
         force: bool = False,
+        stale_ok: bool = False,
+        hard_exp: int = FULL_HARD_TTL,
     ) -> UserFull:
         """
         Gets the FullUserRequest and cache it
@@ -381,6 +1104,8 @@ class CustomTelegramClient(TelegramClient):
         :param entity: User to fetch UserFull of
         :param exp: Expiration time of the cache record and maximum time of already cached record
         :param force: Whether to force refresh the cache (make API request)
+        :param stale_ok: Return expired record immediately, refreshing it in background
+        :param hard_exp: Maximum time of already cached record in `stale_ok` mode
         :return: :obj:`UserFull`
         """
         if not hashable(entity):
@@ -405,24 +1130,50 @@ class CustomTelegramClient(TelegramClient):
         if str(hashable_entity).isdigit() and int(hashable_entity) < 0:
             hashable_entity = int(str(hashable_entity)[4:])
 
-        if (
-            not force
-            and self._hikka_fulluser_cache.get(hashable_entity)
-            and not self._hikka_fulluser_cache[hashable_entity].expired
-            and self._hikka_fulluser_cache[hashable_entity].ts + exp > time.time()
+        def factory():
+            return self._fetch_fulluser(entity, hashable_entity, exp)
+
+        if not force and (
+            record := self._get_full_record(
+                "fulluser",
+                hashable_entity,
+                exp,
+                stale_ok,
+                hard_exp,
+                factory,
+            )
         ):
-            return self._hikka_fulluser_cache[hashable_entity].full_user
+            return record.full_user
+
+        return await self._single_flight("fulluser", hashable_entity, factory)
 
+    async def _fetch_fulluser(
+        self,
+        entity: EntityLike,
+        hashable_entity: typing.Hashable,
+        exp: int,
+    ) -> UserFull:
         result = await self(GetFullUserRequest(entity))
-        self._hikka_fulluser_cache[hashable_entity] = CacheRecordFullUser(
+        self._hikka_fulluser_cache.set(
             hashable_entity,
-            result,
-            exp,
+            CacheRecordFullUser(hashable_entity, result, exp),
+            max(exp, self._hikka_fulluser_cache.ttl),
         )
         return result
 
     @staticmethod
+    def _is_topic_message(chat_id: int, obj: typing.Any) -> bool:
+        """
+        Checks whether the object is a message in forum topic of chat
+        """
+        return (
+            isinstance(obj, Message)
+            and getattr(obj.reply_to, "forum_topic", False)
+            and chat_id == getattr(obj.peer_id, "channel_id", None)
+        )
+
     def _find_message_obj_in_frame(
+        self,
         chat_id: int,
         frame: inspect.FrameInfo,
     ) -> typing.Optional[Message]:
@@ -434,41 +1185,41 @@ class CustomTelegramClient(TelegramClient):
             (
                 obj
                 for obj in frame.frame.f_locals.values()
-                if isinstance(obj, Message)
-                and getattr(obj.reply_to, "forum_topic", False)
-                and chat_id == getattr(obj.peer_id, "channel_id", None)
+                if self._is_topic_message(chat_id, obj)
             ),
             None,
         )
 
-    async def _find_message_obj_in_stack(
+    async def _find_message_obj(
         self,
         chat: EntityLike,
-        stack: typing.List[inspect.FrameInfo],
     ) -> typing.Optional[Message]:
         """
-        Finds the message object from the stack
+        Finds the message object, which triggered the current code. If it's not
+        known from the execution context, searches the stack of awaiting frames
         """
-        chat_id = (await self.get_entity(chat, exp=0)).id
+        chat_id = (await self.get_entity(chat, exp=0, readonly=True)).id
+        if (context := get_context()) and self._is_topic_message(
+            chat_id,
+            context.message,
+        ):
+            return context.message
+
         logger.debug("Finding message object in stack for chat %s", chat_id)
         return next(
             (
-                self._find_message_obj_in_frame(chat_id, frame_info)
-                for frame_info in stack
-                if self._find_message_obj_in_frame(chat_id, frame_info)
+                message
+                for frame_info in inspect.stack(0)
+                if (message := self._find_message_obj_in_frame(chat_id, frame_info))
             ),
             None,
         )
 
-    async def _find_topic_in_stack(
-        self,
-        chat: EntityLike,
-        stack: typing.List[inspect.FrameInfo],
-    ) -> typing.Optional[Message]:
+    async def _find_topic(self, chat: EntityLike) -> typing.Optional[int]:
         """
-        Finds the message object from the stack
+        Finds the topic id of the message, which triggered the current code
         """
-        message = await self._find_message_obj_in_stack(chat, stack)
+        message = await self._find_message_obj(chat)
         return (
             (message.reply_to.reply_to_top_id or message.reply_to.reply_to_msg_id)
             if message
@@ -478,7 +1229,6 @@ class CustomTelegramClient(TelegramClient):
     async def _topic_guesser(
         self,
         native_method: typing.Callable[..., typing.Awaitable[Message]],
-        stack: typing.List[inspect.FrameInfo],
         *args,
         **kwargs,
     ):
@@ -491,7 +1241,7 @@ class CustomTelegramClient(TelegramClient):
 
             logger.debug("Topic deleted, trying to guess topic id")
 
-            topic = await self._find_topic_in_stack(args[0], stack)
+            topic = await self._find_topic(args[0])
 
             logger.debug("Guessed topic id: %s", topic)
 
@@ -500,22 +1250,38 @@ class CustomTelegramClient(TelegramClient):
 
             kwargs["reply_to"] = topic
             kwargs["_topic_no_retry"] = True
-            return await self._topic_guesser(native_method, stack, *args, **kwargs)
+            return await self._topic_guesser(native_method, *args, **kwargs)
 
     async def send_file(self, *args, **kwargs) -> Message:
-        return await self._topic_guesser(
-            TelegramClient.send_file,
-            inspect.stack(),
-            *args,
-            **kwargs,
-        )
+        return await self._topic_guesser(TelegramClient.send_file, *args, **kwargs)
 
     async def send_message(self, *args, **kwargs) -> Message:
-        return await self._topic_guesser(
-            TelegramClient.send_message,
-            inspect.stack(),
-            *args,
-            **kwargs,
+        return await self._topic_guesser(TelegramClient.send_message, *args, **kwargs)
+
+    @staticmethod
+    def _find_external_caller() -> typing.Optional[Module]:
+        """
+        Finds non-core module, on behalf of which the current code runs
+        """
+        if (context := get_context()) and context.is_external:
+            return context.module
+
+        # Context is not set or belongs to core module, which could have called
+        # external module's code (e.g. `client_ready`), so check the stack as well
+        return next(
+            (
+                frame_info.frame.f_locals["self"]
+                for frame_info in inspect.stack(0)
+                if hasattr(frame_info, "frame")
+                and hasattr(frame_info.frame, "f_locals")
+                and isinstance(frame_info.frame.f_locals, dict)
+                and "self" in frame_info.frame.f_locals
+                and isinstance(frame_info.frame.f_locals["self"], Module)
+                and not getattr(
+                    frame_info.frame.f_locals["self"], "__origin__", ""
+                ).startswith("<core")
+            ),
+            None,
         )
 
     async def _call(
@@ -551,20 +1317,9 @@ class CustomTelegramClient(TelegramClient):
         new_request = []
 
         for item in request:
-            if item.CONSTRUCTOR_ID in self._forbidden_constructors and next(
-                (
-                    frame_info.frame.f_locals["self"]
-                    for frame_info in inspect.stack()
-                    if hasattr(frame_info, "frame")
-                    and hasattr(frame_info.frame, "f_locals")
-                    and isinstance(frame_info.frame.f_locals, dict)
-                    and "self" in frame_info.frame.f_locals
-                    and isinstance(frame_info.frame.f_locals["self"], Module)
-                    and not getattr(
-                        frame_info.frame.f_locals["self"], "__origin__", ""
-                    ).startswith("<core")
-                ),
-                None,
+            if (
+                item.CONSTRUCTOR_ID in self._forbidden_constructors
+                and self._find_external_caller()
             ):
                 logger.debug(
                     "🎉 I protected you from unintented %s (%s)!",
@@ -604,6 +1359,114 @@ class CustomTelegramClient(TelegramClient):
         """
         self._forbidden_constructors = list(set(constructors))
 
+    def _hikka_refresh_entity(
+        self,
+        entity_id: int,
+        entity: typing.Optional[Entity] = None,
+    ):
+        """
+        Replaces cached entity with fresh one, or drops it if there is none
+        :param entity_id: Id of entity
+        :param entity: Fresh entity
+        """
+        cache = self._hikka_entity_cache
+        if entity_id not in cache:
+            return
+
+        expires = cache.expires(entity_id)
+        record = cache.pop(entity_id)
+        if entity is None:
+            logger.debug("Dropped cached entity %s", entity_id)
+            return
+
+        record.entity = entity
+        record.ts = time.time()
+        cache.set(
+            entity.id,
+            record,
+            expires - record.ts,
+            self._get_entity_aliases(entity),
+        )
+        logger.debug("Patched cached entity %s", entity_id)
+
+    def _hikka_invalidate_caches(self, updates: list, users: list, chats: list):
+        """
+        Patches or drops cached records, which are affected by updates
+        :param updates: Updates to process
+        :param users: Users, which came with updates
+        :param chats: Chats, which came with updates
+        """
+        # Min entities lack some fields, so they can't replace cached ones
+        entities = {
+            get_peer_id(entity): entity
+            for entity in itertools.chain(users, chats)
+            if not getattr(entity, "min", False)
+        }
+
+        for update in updates:
+            if isinstance(update, UpdateUserName):
+                if (entity := entities.get(update.user_id)) is None and (
+                    record := self._hikka_entity_cache.get(update.user_id)
+                ):
+                    entity = shallow_copy(record.entity)
+                    entity.first_name = update.first_name
+                    entity.last_name = update.last_name
+                    entity.usernames = update.usernames or None
+                    entity.username = next(
+                        (
+                            username.username
+                            for username in update.usernames
+                            if username.editable
+                        ),
+                        None,
+                    )
+
+                self._hikka_refresh_entity(update.user_id, entity)
+                self._hikka_fulluser_cache.pop(update.user_id)
+            elif isinstance(update, UpdateUser):
+                self._hikka_refresh_entity(
+                    update.user_id,
+                    entities.get(update.user_id),
+                )
+                self._hikka_fulluser_cache.pop(update.user_id)
+            elif isinstance(update, UpdateChannel):
+                peer_id = get_peer_id(PeerChannel(update.channel_id))
+                self._hikka_refresh_entity(update.channel_id, entities.get(peer_id))
+                self._hikka_fullchannel_cache.pop(update.channel_id)
+                self._hikka_fullchannel_cache.pop(peer_id)
+                # Own rights in channel are changed with this update too
+                self._hikka_perms_cache.pop((update.channel_id, self.tg_id))
+            elif isinstance(update, UpdateChannelParticipant):
+                self._hikka_forget_perms(update.channel_id, update.user_id)
+            elif isinstance(
+                update,
+                (
+                    UpdateChatParticipantAdmin,
+                    UpdateChatParticipantAdd,
+                    UpdateChatParticipantDelete,
+                ),
+            ):
+                self._hikka_forget_perms(update.chat_id, update.user_id)
+
+    def _hikka_forget_perms(self, chat_id: int, user_id: int):
+        """
+        Drop cached participant permissions along with security decisions,
+        which were made upon them
+        :param chat_id: Chat ID without -100
+        :param user_id: User ID
+        """
+        self._hikka_perms_cache.pop((chat_id, user_id))
+        if (dispatcher := getattr(self, "dispatcher", None)) is not None:
+            dispatcher.security.forget(chat_id, user_id)
+
+    def _preprocess_updates(self, updates: list, users: list, chats: list) -> list:
+        try:
+            self._hikka_invalidate_caches(updates, users, chats)
+        except Exception:
+            logger.debug("Can't invalidate caches with updates", exc_info=True)
+
+        return super()._preprocess_updates(updates, users, chats)
+
     def _handle_update(
         self: "CustomTelegramClient",
         update: typing.Union[Updates, UpdatesCombined, UpdateShort],
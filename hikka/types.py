@@ -65,6 +65,7 @@ __all__ = [
     "BotInlineMessage",
     "PointerDict",
     "PointerList",
+    "ParsedCommand",
 ]
 
 logger = logging.getLogger(__name__)
@@ -1027,6 +1028,25 @@ def _get_members(
     }
 
 
+@dataclass
+class ParsedCommand:
+    """
+    Command message, parsed once by dispatcher. Attached to
+    the message as `hikka_parsed_command` and reused by argument helpers
+    """
+
+    prefix: str
+    alias: str
+    tag: typing.Optional[str] = None
+    command: str = ""
+    source: str = ""
+    args_raw: str = ""
+    grep: typing.Union[str, bool] = False
+    ungrep: typing.Union[str, bool] = False
+    args: typing.Optional[typing.Union[typing.List[str], str]] = None
+    args_html: typing.Optional[str] = None
+
+
 class CacheRecordEntity:
     def __init__(
         self,
@@ -1034,7 +1054,7 @@ class CacheRecordEntity:
         resolved_entity: EntityLike,
         exp: int,
     ):
-        self.entity = copy.deepcopy(resolved_entity)
+        self.entity = resolved_entity
         self._hashable_entity = copy.deepcopy(hashable_entity)
         self._exp = round(time.time() + exp)
         self.ts = time.time()
@@ -1067,7 +1087,7 @@ class CacheRecordPerms:
         resolved_perms: EntityLike,
         exp: int,
     ):
-        self.perms = copy.deepcopy(resolved_perms)
+        self.perms = resolved_perms
         self._hashable_entity = copy.deepcopy(hashable_entity)
         self._hashable_user = copy.deepcopy(hashable_user)
         self._exp = round(time.time() + exp)
@@ -96,7 +96,7 @@ from hikkatl.tl.types import (
 from ._internal import fw_protect
 from .inline.types import InlineCall, InlineMessage
 from .tl_cache import CustomTelegramClient
-from .types import HikkaReplyMarkup, ListLike, Module
+from .types import HikkaReplyMarkup, ListLike, Module, ParsedCommand
 
 FormattingEntity = typing.Union[
     MessageEntityUnknown,
@@ -134,26 +134,53 @@ parser = hikkatl.utils.sanitize_parse_mode("html")
 logger = logging.getLogger(__name__)
 
 
+def get_parsed_command(
+    message: typing.Union[Message, str],
+) -> typing.Optional[ParsedCommand]:
+    """
+    Get command, parsed by dispatcher, if it still matches the message
+    :param message: Message to get parsed command from
+    :return: Parsed command or None
+    """
+    if (
+        parsed := getattr(message, "hikka_parsed_command", None)
+    ) is not None and parsed.source == getattr(message, "message", None):
+        return parsed
+
+    return None
+
+
+def _split_args(args: str) -> typing.Union[typing.List[str], str]:
+    if not args:
+        return []
+
+    try:
+        split = shlex.split(args)
+    except ValueError:
+        return args  # Cannot split, let's assume that it's just one long message
+
+    return list(filter(lambda x: len(x) > 0, split))
+
+
 def get_args(message: typing.Union[Message, str]) -> typing.List[str]:
     """
     Get arguments from message
     :param message: Message or string to get arguments from
     :return: List of arguments
     """
+    if (parsed := get_parsed_command(message)) is not None:
+        if parsed.args is None:
+            parsed.args = _split_args(parsed.args_raw)
+
+        return parsed.args.copy() if isinstance(parsed.args, list) else parsed.args
+
     if not (message := getattr(message, "message", message)):
         return False
 
     if len(message := message.split(maxsplit=1)) <= 1:
         return []
 
-    message = message[1]
-
-    try:
-        split = shlex.split(message)
-    except ValueError:
-        return message  # Cannot split, let's assume that it's just one long message
-
-    return list(filter(lambda x: len(x) > 0, split))
+    return _split_args(message[1])
 
 
 def get_args_raw(message: typing.Union[Message, str]) -> str:
@@ -162,6 +189,9 @@ def get_args_raw(message: typing.Union[Message, str]) -> str:
     :param message: Message or string to get arguments from
     :return: Raw string of arguments
     """
+    if (parsed := get_parsed_command(message)) is not None:
+        return parsed.args_raw
+
     if not (message := getattr(message, "message", message)):
         return False
 
@@ -174,9 +204,17 @@ def get_args_html(message: Message) -> str:
     :param message: Message to get arguments from
     :return: String with HTML arguments
     """
-    prefix = message.client.loader.get_prefix()
+    if (parsed := get_parsed_command(message)) is not None:
+        if parsed.args_html is None:
+            parsed.args_html = _get_args_html(message.text, parsed.prefix)
+
+        return parsed.args_html
+
+    return _get_args_html(message.text, message.client.loader.get_prefix())
+
 
-    if not (message := message.text):
+def _get_args_html(message: str, prefix: str) -> str:
+    if not message:
         return False
 
     if prefix not in message:
@@ -0,0 +1,10 @@
+# ©️ Dan Gazizullin, 2021-2023
+# This file is a part of Hikka Userbot
+# 🌐 https://github.com/hikariatama/Hikka
+# You can redistribute it and/or modify it under the terms of the GNU AGPLv3
+# 🔑 https://www.gnu.org/licenses/agpl-3.0.html
+
+import sys
+
+# `hikka.main` parses command line on import, so pytest arguments must be hidden
+sys.argv = sys.argv[:1]
@@ -0,0 +1,85 @@
+# ©️ Dan Gazizullin, 2021-2023
+# This file is a part of Hikka Userbot
+# 🌐 https://github.com/hikariatama/Hikka
+# You can redistribute it and/or modify it under the terms of the GNU AGPLv3
+# 🔑 https://www.gnu.org/licenses/agpl-3.0.html
+
+from unittest import mock
+
+import pytest
+
+from hikka import main  # noqa: F401  # Resolves circular imports of dispatcher
+from hikka import dispatcher
+
+
+@pytest.fixture
+def clock():
+    now = [0.0]
+    with mock.patch.object(dispatcher.time, "monotonic", lambda: now[0]):
+        yield now
+
+
+def _held(limiter: dispatcher.SeverityLimiter, key: int) -> float:
+    return sum(weight for _, weight in limiter._keys[key][1])
+
+
+def test_level_expires(clock):
+    limiter = dispatcher.SeverityLimiter()
+    assert limiter.add(1, 5, 10) == 5
+    assert limiter.add(1, 2, 20) == 7
+    clock[0] = 10
+    assert limiter.level(1) == 2
+    clock[0] = 20
+    assert limiter.level(1) == 0
+    assert not len(limiter)
+
+
+def test_overflow_keeps_level(clock):
+    limiter = dispatcher.SeverityLimiter(max_entries=4)
+    for i in range(10):
+        clock[0] = i
+        level = limiter.add(1, 2, 100)
+        assert level == 2 * (i + 1) == _held(limiter, 1)
+
+    assert len(limiter._keys[1][1]) == 4
+
+    # Merged weights are held longer, never shorter, than they would be
+    for i in range(10, 200):
+        clock[0] = i
+        level = limiter.level(1)
+        assert level >= 0
+        assert level == (_held(limiter, 1) if len(limiter) else 0)
+        assert level >= 2 * sum(1 for j in range(10) if j + 100 > i)
+
+
+def test_matches_timers(clock):
+    """Each message holds its severity for `max * severity` seconds"""
+
+    def timers(interval: float, base: int, calls: int = 200, limit: int = 30):
+        level, allowed, expiries = 0, 0, []
+        for i in range(calls):
+            now = i * interval
+            for expiry in [e for e in expiries if e[0] <= now]:
+                expiries.remove(expiry)
+                level -= expiry[1]
+
+            severity = base * (level // 30 + 1)
+            level += severity
+            allowed += level <= limit
+            expiries.append((now + limit * severity, severity))
+
+        return allowed
+
+    for interval in (0.5, 1, 5, 12, 20, 30, 60):
+        for base in (2, 5):
+            limiter = dispatcher.SeverityLimiter()
+            allowed = 0
+            for i in range(200):
+                clock[0] = i * interval
+                severity = base * (int(limiter.level(1)) // 30 + 1)
+                allowed += limiter.add(1, severity, 30 * severity) <= 30
+
+            assert allowed == timers(interval, base), (interval, base)
+
+    # Severity-5 command, called every 12 seconds, is let through 6 times
+    assert timers(12, 5) == 6
@@ -0,0 +1,54 @@
+# ©️ Dan Gazizullin, 2021-2023
+# This file is a part of Hikka Userbot
+# 🌐 https://github.com/hikariatama/Hikka
+# You can redistribute it and/or modify it under the terms of the GNU AGPLv3
+# 🔑 https://www.gnu.org/licenses/agpl-3.0.html
+
+import asyncio
+
+import pytest
+
+from hikka import main  # noqa: F401  # Resolves circular imports of dispatcher
+from hikka import dispatcher
+
+
+def _fill(policy: str) -> list:
+    """Occupies the only slot and fills the queue with watchers"""
+    started = []
+
+    async def run():
+        scheduler = dispatcher.TaskScheduler(
+            module_limit=1,
+            queue_size=2,
+            overflow=policy,
+        )
+        gate = asyncio.Event()
+
+        def job(name: str):
+            async def factory():
+                started.append(name)
+                await gate.wait()
+
+            return factory
+
+        await scheduler.submit("mod", dispatcher.PRIORITY_WATCHER, job("busy"))
+        await asyncio.sleep(0)
+        for name in ("watcher1", "watcher2"):
+            await scheduler.submit("mod", dispatcher.PRIORITY_WATCHER, job(name))
+
+        assert await scheduler.submit("mod", dispatcher.PRIORITY_OWNER, job("owner"))
+        assert scheduler.stats()["modules"]["mod"]["dropped"] == 1
+
+        gate.set()
+        for _ in range(10):
+            await asyncio.sleep(0)
+
+    asyncio.run(asyncio.wait_for(run(), 1))
+    return started
+
+
+@pytest.mark.parametrize("policy", sorted(dispatcher.OVERFLOW_POLICIES))
+def test_priority_wins_overflow(policy):
+    started = _fill(policy)
+    assert started[:2] == ["busy", "owner"]
+    assert len(started) == 3